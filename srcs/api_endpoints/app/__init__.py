@@ -6,10 +6,12 @@ def create_app():
 
 
     # register blueprints
-    from .routes.ingest_routes import ingest_bp
+    from .routes.ingest_routes import UploadRequest, ingest_bp
     from .routes.query_routes import query_bp
     from .routes.query_routes import generate_data_bp
 
+    # uploads are spooled where the ingest queue keeps them
+    app.request_class = UploadRequest
     app.register_blueprint(ingest_bp, url_prefix="/api")
     app.register_blueprint(query_bp, url_prefix="/api")
     app.register_blueprint(generate_data_bp, url_prefix="/api")
@@ -18,4 +20,13 @@ def create_app():
     from .db.vector_store import VectorStore
     VectorStore().initialize()
 
+    # load the retrieval index before the worker starts taking requests
+    from .logic.retrieval_logic import RETRIEVAL_WARM_UP, warm_up
+    if RETRIEVAL_WARM_UP:
+        warm_up()
+
+    # resume ingest jobs left unfinished by a previous run
+    from .logic.job_logic import get_queue
+    get_queue().start()
+
     return app
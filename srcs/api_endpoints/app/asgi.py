@@ -0,0 +1,151 @@
+"""ASGI entry point: /api/query and /api/generate-data served natively async.
+
+Retrieval (CPU-bound) runs in a thread pool and the LLM call goes through
+the async client, so a worker is not pinned while Featherless answers.
+Every other route is the regular Flask app behind asgiref's WSGI adapter.
+
+    cd srcs/api_endpoints && uvicorn asgi:app --workers 4
+"""
+import asyncio
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.wsgi import WsgiToAsgi
+
+from . import create_app
+from .logic.retrieval_logic import retrieve
+from .logic import async_generation_logic as agen
+from .logic.generation_logic import build_data_prompt, build_prompt
+from .logic.metrics import collect_timings
+from .routes.query_routes import NO_CONTEXT_ANSWER, pack_context, parse_retrieval_body, sse
+
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", os.cpu_count() or 4))
+
+_retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieve")
+
+_CORS = [(b"access-control-allow-origin", b"*")]
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return json.loads(body or b"{}")
+
+
+async def _send_json(send, status: int, payload: dict):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())] + _CORS})
+    await send({"type": "http.response.body", "body": data})
+
+
+async def _send_events(send, events):
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                            (b"x-accel-buffering", b"no")] + _CORS})
+    async for event in events:
+        await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _retrieve(q: str, args: dict) -> list:
+    loop = asyncio.get_running_loop()
+    # run in this request's context so its timings see the retrieval stages
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_retrieval_pool, partial(context.run, retrieve, q, **args))
+
+
+async def _query(body: dict, send):
+    q = body.get("query")
+    if not q:
+        return await _send_json(send, 400, {"error": "Missing 'query' in body"})
+    args, error = parse_retrieval_body(body)
+    if error:
+        return await _send_json(send, 400, {"error": error})
+    with collect_timings(bool(body.get("timings"))) as timings:
+        retrieved = await _retrieve(q, args)
+        context_chunks, chunk_ids, tokens = pack_context(q, retrieved, build_prompt)
+
+        if body.get("stream"):
+            async def events():
+                yield sse("context", {"used_context": context_chunks, "prompt_tokens": tokens})
+                if not context_chunks:
+                    yield sse("token", {"token": NO_CONTEXT_ANSWER})
+                else:
+                    try:
+                        async for token in agen.astream_answer(q, context_chunks, chunk_ids):
+                            yield sse("token", {"token": token})
+                    except Exception as e:
+                        yield sse("error", {"error": str(e)})
+                        return
+                yield sse("done", {})
+            return await _send_events(send, events())
+
+        if not context_chunks:
+            payload = {"answer": NO_CONTEXT_ANSWER, "used_context": [], "prompt_tokens": 0}
+        else:
+            answer = await agen.agenerate_answer(q, context_chunks, chunk_ids)
+            payload = {"answer": answer, "used_context": context_chunks, "prompt_tokens": tokens}
+    if timings is not None:
+        payload["timings"] = timings
+    await _send_json(send, 200, payload)
+
+
+async def _generate_data(body: dict, send):
+    q = body.get("query")
+    if not q:
+        return await _send_json(send, 400, {"error": "Missing 'query' field"})
+    args, error = parse_retrieval_body(body)
+    if error:
+        return await _send_json(send, 400, {"error": error})
+    with collect_timings(bool(body.get("timings"))) as timings:
+        retrieved = await _retrieve(q, args)
+        context_chunks, chunk_ids, tokens = pack_context(q, retrieved, build_data_prompt)
+        if not context_chunks:
+            payload = {"data": [], "used_context": [], "prompt_tokens": 0}
+        else:
+            data = await agen.agenerate_structured_data(q, context_chunks, chunk_ids)
+            payload = {"data": data, "used_context": context_chunks, "prompt_tokens": tokens}
+    if timings is not None:
+        payload["timings"] = timings
+    await _send_json(send, 200, payload)
+
+
+ASYNC_ROUTES = {
+    "/api/query": _query,
+    "/api/generate-data": _generate_data,
+}
+
+
+def create_asgi_app():
+    wsgi = WsgiToAsgi(create_app())
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await agen.aclose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        handler = ASYNC_ROUTES.get(scope.get("path"))
+        if scope["type"] == "http" and scope["method"] == "POST" and handler is not None:
+            try:
+                body = await _read_json(receive)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                return await _send_json(send, 400, {"error": "Invalid JSON body"})
+            return await handler(body, send)
+
+        await wsgi(scope, receive, send)
+
+    return app
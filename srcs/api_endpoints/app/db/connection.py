@@ -0,0 +1,76 @@
+"""Shared SQLite connections per database file.
+
+Every connection is opened in WAL mode with a busy timeout, so readers are
+never blocked by a writer and writers wait for each other instead of
+failing with "database is locked". Reads use one connection per thread;
+writes from this process go through a single connection serialized by a
+lock, leaving SQLite's file locking to arbitrate only between processes.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT", 30))
+
+
+class ConnectionManager:
+    def __init__(self, db_path: str, busy_timeout: float = BUSY_TIMEOUT_SECONDS):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._writer = None
+
+    def connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        """A new, configured connection; also the `creator` for SQLAlchemy engines."""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode = WAL")
+        # WAL makes NORMAL durable enough and spares an fsync per commit
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -16000")
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    @contextmanager
+    def writer(self, blocking: bool = True) -> Iterator[Optional[sqlite3.Connection]]:
+        """The process-wide write connection, committed on exit and rolled back on error.
+
+        With blocking=False, yields None instead of waiting when another thread is writing.
+        """
+        if not self._write_lock.acquire(blocking):
+            yield None
+            return
+        try:
+            if self._writer is None:
+                self._writer = self.connect(check_same_thread=False)
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            self._write_lock.release()
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path: str) -> ConnectionManager:
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = ConnectionManager(db_path)
+    return manager
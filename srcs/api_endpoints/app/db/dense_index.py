@@ -0,0 +1,255 @@
+"""IVF (inverted file) index over dense chunk embeddings, persisted next to the DB.
+
+Vectors live in the `chunk_embeddings` table; this module keeps them in a
+NumPy matrix clustered around spherical k-means centroids and only scans
+the `nprobe` closest clusters per query. New chunks are assigned to the
+existing centroids and the clustering is retrained once the corpus has
+doubled since the last training run. Only the clustering (centroids and
+list assignments) is persisted; vectors are read back from the DB.
+
+Chunks without an embedding (ingested with EMBED_ON_INGEST=0, before
+embeddings existed, or by another model) are embedded by a background
+thread; until it is done, dense search only sees the embedded chunks.
+Requires numpy.
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .connection import get_manager
+from .vector_store import ann_index_path
+
+NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+EMBED_BACKFILL_BATCH = 256
+
+
+class DenseIndex:
+    def __init__(self, db_path: str, embedder):
+        self.db_path = db_path
+        self.embedder = embedder
+        self.lock = threading.Lock()
+        self.generation = None
+        self.complete = False  # every chunk has an embedding from this embedder
+        self._backfill_thread = None
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.chunk_ids = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.centroids = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.trained_size = 0
+        self._lists: List[np.ndarray] = []
+        self._saved = None  # (chunk_ids, assign) of the persisted clustering, until the vectors are read
+
+    # ---------- persistence ----------
+
+    def _load(self):
+        path = ann_index_path(self.db_path)
+        if not os.path.exists(path):
+            return
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["model"]) != self.embedder.name or "vectors" in data.files:
+                return  # another embedder, or the old format that also stored every vector
+            self.centroids = data["centroids"]
+            self.trained_size = int(data["trained_size"])
+            if len(data["chunk_ids"]):
+                self._saved = (data["chunk_ids"], data["assign"])
+
+    def _save(self):
+        path = ann_index_path(self.db_path)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, model=np.array(self.embedder.name), chunk_ids=self.chunk_ids, centroids=self.centroids,
+                     assign=self.assign, trained_size=np.array(self.trained_size))
+        os.replace(tmp, path)
+
+    # ---------- maintenance ----------
+
+    def sync(self, generation=None) -> "DenseIndex":
+        """Bring the index up to date with the embeddings in the DB; cheap when `generation` has not moved.
+
+        Missing embeddings are left to the background backfill, which makes
+        the next sync look again when it is done.
+        """
+        with self.lock:
+            if generation is not None and generation == self.generation:
+                return self
+            conn = get_manager(self.db_path).reader()
+            self.complete = not self._has_missing(conn)
+            if not self.complete:
+                self._start_backfill()
+            count, max_id = conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(chunk_id), 0) FROM chunk_embeddings WHERE model = ?",
+                (self.embedder.name,)
+            ).fetchone()
+            known_max = int(self.chunk_ids.max()) if len(self.chunk_ids) else 0
+            if count != len(self.chunk_ids) or max_id != known_max:
+                new_ids, new_vectors = self._read(conn, known_max)
+                if len(self.chunk_ids) + len(new_ids) != count:
+                    # rows were deleted or replaced; start over
+                    self._reset()
+                    new_ids, new_vectors = self._read(conn, 0)
+                self._add(new_ids, new_vectors)
+            self.generation = generation
+            return self
+
+    def _has_missing(self, conn) -> bool:
+        return conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM chunks c "
+            "LEFT JOIN chunk_embeddings e ON e.chunk_id = c.id AND e.model = ? WHERE e.chunk_id IS NULL)",
+            (self.embedder.name,)
+        ).fetchone()[0] == 1
+
+    def _start_backfill(self):
+        if self._backfill_thread is None or not self._backfill_thread.is_alive():
+            self._backfill_thread = threading.Thread(target=self.backfill, name="dense-backfill", daemon=True)
+            self._backfill_thread.start()
+
+    def backfill(self) -> int:
+        """Embed every chunk that has no vector from this embedder yet; returns how many were embedded."""
+        try:
+            return self._embed_missing()
+        finally:
+            with self.lock:
+                self.generation = None  # pick up the new embeddings on the next sync
+
+    def _embed_missing(self) -> int:
+        conn = get_manager(self.db_path).reader()
+        done = last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT c.id, c.chunk_text FROM chunks c "
+                "LEFT JOIN chunk_embeddings e ON e.chunk_id = c.id AND e.model = ? "
+                "WHERE e.chunk_id IS NULL AND c.id > ? ORDER BY c.id LIMIT ?",
+                (self.embedder.name, last_id, EMBED_BACKFILL_BATCH)
+            ).fetchall()
+            if not rows:
+                return done
+            vectors = self.embedder.embed([text for _, text in rows])
+            with get_manager(self.db_path).writer() as writer:
+                # a chunk deleted in the meantime must not leave an embedding behind
+                writer.executemany(
+                    "INSERT OR REPLACE INTO chunk_embeddings (chunk_id, model, vector) "
+                    "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM chunks WHERE id = ?)",
+                    [(chunk_id, self.embedder.name, v.tobytes(), chunk_id) for (chunk_id, _), v in zip(rows, vectors)]
+                )
+            done += len(rows)
+            last_id = rows[-1][0]
+
+    def _read(self, conn, after_id: int):
+        cur = conn.execute(
+            "SELECT chunk_id, vector FROM chunk_embeddings WHERE model = ? AND chunk_id > ? ORDER BY chunk_id",
+            (self.embedder.name, after_id)
+        )
+        ids, vectors = [], []
+        for chunk_id, blob in cur:
+            ids.append(chunk_id)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return np.asarray(ids, dtype=np.int64), matrix
+
+    def _add(self, ids: np.ndarray, vectors: np.ndarray):
+        self.chunk_ids = np.concatenate([self.chunk_ids, ids])
+        self.vectors = np.vstack([self.vectors, vectors])
+        if len(self.centroids) == 0 or len(self.chunk_ids) >= 2 * self.trained_size:
+            self._train()
+            self._save()
+        else:
+            self.assign = np.concatenate([self.assign, self._restore(ids, vectors)])
+        self._build_lists()
+
+    def _restore(self, ids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Assignments for new rows: the persisted ones where known, else the nearest centroid."""
+        if self._saved is None:
+            return self._nearest(vectors)
+        saved_ids, saved_assign = self._saved
+        self._saved = None
+        pos = np.minimum(np.searchsorted(saved_ids, ids), len(saved_ids) - 1)
+        known = saved_ids[pos] == ids
+        assign = np.empty(len(ids), dtype=np.int32)
+        assign[known] = saved_assign[pos[known]]
+        assign[~known] = self._nearest(vectors[~known])
+        return assign
+
+    def _train(self):
+        n = len(self.vectors)
+        if n == 0:
+            self.centroids = np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self.assign = np.zeros(0, dtype=np.int32)
+            self.trained_size = 0
+            return
+        rng = np.random.default_rng(0)
+        n_lists = max(1, int(np.sqrt(n)))
+        sample = self.vectors[rng.choice(n, size=min(n, KMEANS_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[labels == c]
+                if len(members):
+                    mean = members.sum(axis=0)
+                    norm = np.linalg.norm(mean)
+                    centroids[c] = mean / norm if norm else mean
+        self.centroids = centroids
+        self.assign = self._nearest(self.vectors)
+        self.trained_size = n
+        self._saved = None
+
+    def _nearest(self, vectors: np.ndarray) -> np.ndarray:
+        if len(vectors) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _build_lists(self):
+        order = np.argsort(self.assign, kind="stable")
+        bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    # ---------- search ----------
+
+    def search(self, query, top_k: int, allowed: Optional[Set[int]] = None,
+               nprobe: int = NPROBE) -> List[Tuple[float, int]]:
+        with self.lock:
+            if top_k <= 0 or len(self.chunk_ids) == 0:
+                return []
+            q = np.frombuffer(query, dtype=np.float32) if not isinstance(query, np.ndarray) else query
+            allowed_ids = np.fromiter(allowed, dtype=np.int64, count=len(allowed)) if allowed is not None else None
+            results = self._search(q, top_k, allowed_ids, min(nprobe, len(self.centroids)))
+            if len(results) < top_k and nprobe < len(self.centroids):
+                # filters emptied the probed clusters; fall back to scanning all of them
+                results = self._search(q, top_k, allowed_ids, len(self.centroids))
+            return results
+
+    def _search(self, q: np.ndarray, top_k: int, allowed_ids, nprobe: int) -> List[Tuple[float, int]]:
+        probes = np.argsort(-(self.centroids @ q))[:nprobe]
+        cand = np.concatenate([self._lists[c] for c in probes])
+        if allowed_ids is not None:
+            cand = cand[np.isin(self.chunk_ids[cand], allowed_ids)]
+        scores = self.vectors[cand] @ q
+        positive = scores > 0
+        cand, scores = cand[positive], scores[positive]
+        if len(cand) > top_k:
+            best = np.argpartition(scores, -top_k)[-top_k:]
+            cand, scores = cand[best], scores[best]
+        ids = self.chunk_ids[cand]
+        order = np.lexsort((ids, -scores))
+        return [(float(scores[i]), int(ids[i])) for i in order]
+
+
+_indexes: Dict[tuple, DenseIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dense_index(db_path: str, embedder) -> DenseIndex:
+    key = (os.path.abspath(db_path), embedder.name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DenseIndex(db_path, embedder)
+    return index
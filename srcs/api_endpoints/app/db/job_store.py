@@ -0,0 +1,148 @@
+import sqlite3
+import json
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from .connection import get_manager
+from .vector_store import DB_PATH
+
+# job lifecycle: queued -> running -> done | failed
+UNFINISHED = ("queued", "running")
+# columns added after the table was first created
+_ADDED_COLUMNS = {"owner": "TEXT", "lease_until": "REAL"}
+
+
+class JobStore:
+    """Ingest jobs persisted in the same SQLite file as the chunks, so they survive restarts."""
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+
+    def initialize(self):
+        with get_manager(self.db_path).writer() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress REAL NOT NULL DEFAULT 0,
+                file_path TEXT NOT NULL,
+                file_name TEXT,
+                metadata_json TEXT,
+                result_json TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL,
+                owner TEXT,
+                lease_until REAL
+            )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ingest_jobs)")}
+            for column, kind in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status)")
+            conn.commit()
+
+    def create(self, file_path: str, file_name: str, metadata: Dict = None, job_id: str = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with get_manager(self.db_path).writer() as conn:
+            conn.execute(
+                "INSERT INTO ingest_jobs (id, status, stage, progress, file_path, file_name, metadata_json, created_at, updated_at) "
+                "VALUES (?, 'queued', 'queued', 0, ?, ?, ?, ?, ?)",
+                (job_id, file_path, file_name, json.dumps(metadata) if metadata is not None else None, now, now)
+            )
+            conn.commit()
+        return job_id
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Mark a job running under `owner` if it is queued or its previous owner's lease ran out.
+
+        Only one of several processes racing for the same job gets True.
+        """
+        now = time.time()
+        with get_manager(self.db_path).writer() as conn:
+            cur = conn.execute(
+                "UPDATE ingest_jobs SET status = 'running', stage = 'ingesting', owner = ?, lease_until = ?, "
+                "updated_at = ? WHERE id = ? AND (status = 'queued' OR (status = 'running' AND "
+                "COALESCE(lease_until, 0) < ?))",
+                (owner, now + lease_seconds, now, job_id, now)
+            )
+            conn.commit()
+        return cur.rowcount == 1
+
+    def renew(self, job_ids: List[str], owner: str, lease_seconds: float):
+        """Extend the leases `owner` holds on running jobs."""
+        if not job_ids:
+            return
+        lease_until = time.time() + lease_seconds
+        with get_manager(self.db_path).writer() as conn:
+            conn.executemany(
+                "UPDATE ingest_jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                [(lease_until, job_id, owner) for job_id in job_ids]
+            )
+            conn.commit()
+
+    def update(self, job_id: str, status: str = None, stage: str = None, progress: float = None,
+               result: Dict = None, error: str = None, owner: str = None) -> bool:
+        """Update a job; with `owner`, only while that owner still holds it. Returns whether a row changed."""
+        fields, values = ["updated_at = ?"], [time.time()]
+        for column, value in (("status", status), ("stage", stage), ("progress", progress), ("error", error)):
+            if value is not None:
+                fields.append(f"{column} = ?")
+                values.append(value)
+        if result is not None:
+            fields.append("result_json = ?")
+            values.append(json.dumps(result))
+        where, params = "id = ?", [job_id]
+        if owner is not None:
+            where += " AND owner = ? AND status = 'running'"
+            params.append(owner)
+        with get_manager(self.db_path).writer() as conn:
+            cur = conn.execute(f"UPDATE ingest_jobs SET {', '.join(fields)} WHERE {where}", (*values, *params))
+            conn.commit()
+        return cur.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        cur = get_manager(self.db_path).reader().cursor()
+        cur.row_factory = sqlite3.Row
+        row = cur.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def unfinished(self) -> List[Dict]:
+        cur = get_manager(self.db_path).reader().cursor()
+        cur.row_factory = sqlite3.Row
+        rows = cur.execute(
+            f"SELECT * FROM ingest_jobs WHERE status IN ({','.join('?' * len(UNFINISHED))}) ORDER BY created_at",
+            UNFINISHED
+        ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def claimable(self) -> List[Dict]:
+        """Queued jobs and running jobs whose owner stopped renewing its lease."""
+        cur = get_manager(self.db_path).reader().cursor()
+        cur.row_factory = sqlite3.Row
+        rows = cur.execute(
+            "SELECT * FROM ingest_jobs WHERE status = 'queued' OR (status = 'running' AND "
+            "COALESCE(lease_until, 0) < ?) ORDER BY created_at",
+            (time.time(),)
+        ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    @staticmethod
+    def _to_dict(row) -> Dict:
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "file_path": row["file_path"],
+            "file_name": row["file_name"],
+            "metadata": json.loads(row["metadata_json"]) if row["metadata_json"] else None,
+            "result": json.loads(row["result_json"]) if row["result_json"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from .connection import get_manager
+from .vector_store import DB_PATH
+
+# cached completions older than this are treated as misses and replaced
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+# least recently used entries are evicted past this many rows
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+
+
+def cache_key(model: str, system_text: str, user_text: str, max_tokens: int) -> str:
+    raw = json.dumps([model, system_text, user_text, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent cache of LLM completions keyed by a hash of the full prompt.
+
+    Only valid for deterministic calls (temperature=0). Entries remember the
+    chunk ids their prompt was built from so they can be dropped when those
+    chunks are deleted or replaced.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, ttl: float = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    def initialize(self):
+        with get_manager(self.db_path).writer() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache_chunks (
+                key TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                PRIMARY KEY (key, chunk_id)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_chunks_chunk ON llm_cache_chunks (chunk_id)")
+            conn.commit()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        manager = get_manager(self.db_path)
+        row = manager.reader().execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+        response, created_at = row
+        if now - created_at > self.ttl:
+            with manager.writer() as conn:
+                self._delete(conn, [key])
+            self._count("expired")
+            self._count("misses")
+            return None
+        # recency is best effort: a hit never waits behind an ingest transaction
+        with manager.writer(blocking=False) as conn:
+            if conn is not None:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return response
+
+    def put(self, key: str, response: str, chunk_ids: Iterable[int] = ()):
+        now = time.time()
+        with get_manager(self.db_path).writer() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO llm_cache_chunks (key, chunk_id) VALUES (?, ?)",
+                [(key, cid) for cid in chunk_ids]
+            )
+            overflow = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                keys = [k for (k,) in conn.execute(
+                    "SELECT key FROM llm_cache ORDER BY last_used LIMIT ?", (overflow,)
+                )]
+                self._delete(conn, keys)
+                with self._lock:
+                    self.stats["evictions"] += len(keys)
+            conn.commit()
+
+    @staticmethod
+    def _delete(conn, keys):
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in keys])
+        conn.executemany("DELETE FROM llm_cache_chunks WHERE key = ?", [(k,) for k in keys])
+
+    def invalidate_chunks(self, chunk_ids: Iterable[int]):
+        """Drop every cached response whose context included one of `chunk_ids`."""
+        with get_manager(self.db_path).writer() as conn:
+            keys = set()
+            for cid in chunk_ids:
+                keys.update(k for (k,) in conn.execute("SELECT key FROM llm_cache_chunks WHERE chunk_id = ?", (cid,)))
+            self._delete(conn, keys)
+            conn.commit()
+
+    def clear(self):
+        with get_manager(self.db_path).writer() as conn:
+            conn.execute("DELETE FROM llm_cache")
+            conn.execute("DELETE FROM llm_cache_chunks")
+            conn.commit()
+
+    def snapshot(self) -> Dict:
+        entries = get_manager(self.db_path).reader().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(entries=entries, max_entries=self.max_entries, ttl_seconds=self.ttl,
+                     hit_rate=stats["hits"] / lookups if lookups else 0.0)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+            _cache.initialize()
+    return _cache
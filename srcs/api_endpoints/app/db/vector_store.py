@@ -1,19 +1,307 @@
+import os
 import sqlite3
 import json
+import math
+import sys
+import threading
 import time
-from typing import List, Dict
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import List, Dict, Iterable, Optional, Tuple
+
+from .connection import get_manager
+
+DB_PATH = os.getenv("RAG_DB_PATH", "rag_demo.sqlite3")
+
+# upper bound for chunk text kept in memory by the process-level cache
+CHUNK_TEXT_CACHE_BYTES = int(os.getenv("RAG_CHUNK_TEXT_CACHE_BYTES", 64 * 1024 * 1024))
+# how often the cache asks SQLite whether another process wrote to the DB
+CACHE_RECHECK_SECONDS = 1.0
+
+# SQLite caps the number of bound parameters per statement
+_IN_BATCH = 500
+# documents columns added after the table was first created
+_ADDED_DOCUMENT_COLUMNS = {"text_hash": "TEXT"}
+
+
+def ann_index_path(db_path: str) -> str:
+    """Where the dense ANN index for `db_path` is persisted."""
+    return db_path + ".ivf.npz"
+
+
+def meta_value(value) -> str:
+    """Normalized form of a metadata value in the chunk_meta index."""
+    return value.lower() if isinstance(value, str) else json.dumps(value)
+
+
+def meta_rows(metadata: Dict) -> List[tuple]:
+    """(key, value) pairs to index for a chunk; list values are indexed per element."""
+    rows = []
+    for key, value in (metadata or {}).items():
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if isinstance(v, (str, int, float, bool)):
+                rows.append((key, meta_value(v)))
+    return rows
+
+
+def shard_of(chunk_id: int, metadata: Dict, n_shards: int, key: str) -> int:
+    """Shard of a chunk: by its smallest normalized value of metadata `key`, by id if it has none."""
+    values = [v for k, v in meta_rows(metadata) if k == key]
+    if values:
+        return zlib.crc32(min(values).encode("utf-8")) % n_shards
+    return chunk_id % n_shards
+
+
+def _batched(items: List, size: int = _IN_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class TokenVector:
+    """Sparse token counts as interned term ids (sorted) and counts packed in uint32 arrays."""
+    __slots__ = ("term_ids", "tfs", "norm")
+
+    def __init__(self, term_ids: array, tfs: array, norm: Optional[float] = None):
+        self.term_ids = term_ids
+        self.tfs = tfs
+        self.norm = norm if norm is not None else math.sqrt(sum(v*v for v in tfs))
+
+    @classmethod
+    def from_counts(cls, counts: Dict[int, int], norm: Optional[float] = None) -> "TokenVector":
+        ids = sorted(counts)
+        return cls(array("I", ids), array("I", (counts[i] for i in ids)), norm)
+
+    @classmethod
+    def from_blobs(cls, term_ids: bytes, tfs: bytes, norm: Optional[float] = None) -> "TokenVector":
+        ids, counts = array("I"), array("I")
+        ids.frombytes(term_ids)
+        counts.frombytes(tfs)
+        return cls(ids, counts, norm)
+
+    def items(self):
+        return zip(self.term_ids, self.tfs)
+
+    def get(self, term_id: int, default: int = 0) -> int:
+        # binary search over the sorted ids, no per-vector dict needed
+        i = bisect_left(self.term_ids, term_id)
+        if i < len(self.term_ids) and self.term_ids[i] == term_id:
+            return self.tfs[i]
+        return default
+
+    def __len__(self):
+        return len(self.term_ids)
+
+
+class ChunkCache:
+    """Decoded chunks and an in-memory inverted index for one database file.
+
+    Posting-list lengths double as document frequencies and per-chunk token
+    counts are summed as rows arrive, so BM25 statistics stay current with
+    every insert without a separate pass.
+
+    Loaded once per process, extended with rows newer than `max_id` when the
+    DB changes and rebuilt when rows disappear (e.g. after clear()). Chunk
+    text is held in an LRU bounded by `max_text_bytes` and read back from
+    SQLite on a miss. Hold `lock` while reading the index structures.
+
+    With `shard=(index, n_shards, key)` only the chunks that shard_of()
+    assigns to `index` are loaded.
+    """
+
+    def __init__(self, db_path: str, max_text_bytes: int = CHUNK_TEXT_CACHE_BYTES,
+                 shard: Optional[Tuple[int, int, str]] = None):
+        self.db_path = db_path
+        self.max_text_bytes = max_text_bytes
+        self.shard = shard
+        self.lock = threading.RLock()
+        self.generation = 0
+        self._conn = None
+        self._data_version = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._reset()
+
+    def _reset(self):
+        self.vectors: Dict[int, TokenVector] = {}
+        self.metadata: Dict[int, dict] = {}
+        self.vocab: Dict[str, int] = {}
+        self.postings: Dict[int, tuple] = {}  # term_id -> (array of chunk ids, array of tfs)
+        self.meta_index: Dict[tuple, set] = {}  # (key, normalized value) -> chunk ids
+        self.lengths: Dict[int, int] = {}  # chunk_id -> number of tokens, for BM25
+        self.total_length = 0
+        self.max_id = 0
+        self._skipped = 0  # rows that belong to other shards
+        self._max_term_id = 0
+        self._texts = OrderedDict()
+        self._text_bytes = 0
+
+    def _connection(self):
+        # a dedicated connection: PRAGMA data_version only tracks commits made by other connections
+        if self._conn is None:
+            self._conn = get_manager(self.db_path).connect(check_same_thread=False)
+        return self._conn
+
+    def mark_stale(self):
+        with self.lock:
+            self._stale = True
+
+    def drop(self):
+        with self.lock:
+            self._reset()
+            self._stale = True
+            self.generation += 1
+
+    def ensure_fresh(self) -> "ChunkCache":
+        with self.lock:
+            now = time.monotonic()
+            if not self._stale and now - self._checked_at < CACHE_RECHECK_SECONDS:
+                return self
+            self._checked_at = now
+            conn = self._connection()
+            # data_version changes whenever another connection commits to the file
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if not self._stale and version == self._data_version:
+                return self
+
+            changed = self._load_new_rows(conn)
+            count = conn.execute("SELECT COUNT(*) FROM chunk_vectors").fetchone()[0]
+            if count != len(self.vectors) + self._skipped:
+                # rows were deleted underneath us; start over
+                self._reset()
+                self._load_new_rows(conn)
+                changed = True
+            if changed:
+                self.generation += 1
+            self._data_version = version
+            self._stale = False
+            return self
+
+    def _load_new_rows(self, conn) -> bool:
+        previous_max = self.max_id
+        cur = conn.execute("SELECT id, term FROM terms WHERE id > ?", (self._max_term_id,))
+        for term_id, term in cur:
+            self.vocab[term] = term_id
+            self._max_term_id = max(self._max_term_id, term_id)
+
+        cur = conn.execute(
+            "SELECT c.id, v.term_ids, v.tfs, n.norm, c.metadata_json FROM chunks c "
+            "JOIN chunk_vectors v ON v.chunk_id = c.id "
+            "JOIN chunk_norms n ON n.chunk_id = c.id "
+            "WHERE c.id > ? ORDER BY c.id",
+            (self.max_id,)
+        )
+        changed = False
+        for chunk_id, term_ids, tfs, norm, metadata_json in cur:
+            metadata = json.loads(metadata_json or "{}")
+            self.max_id = chunk_id
+            if self.shard is not None and shard_of(chunk_id, metadata, *self.shard[1:]) != self.shard[0]:
+                self._skipped += 1
+                continue
+            vector = TokenVector.from_blobs(term_ids, tfs, norm)
+            self.vectors[chunk_id] = vector
+            self.metadata[chunk_id] = metadata
+            length = sum(vector.tfs)
+            self.lengths[chunk_id] = length
+            self.total_length += length
+            for term_id, tf in vector.items():
+                entry = self.postings.get(term_id)
+                if entry is None:
+                    entry = self.postings[term_id] = (array("I"), array("I"))
+                entry[0].append(chunk_id)
+                entry[1].append(tf)
+            changed = True
+
+        if changed:
+            cur = conn.execute(
+                "SELECT chunk_id, key, value FROM chunk_meta WHERE chunk_id > ? AND chunk_id <= ?",
+                (previous_max, self.max_id)
+            )
+            for chunk_id, key, value in cur:
+                if chunk_id in self.vectors:
+                    self.meta_index.setdefault((key, value), set()).add(chunk_id)
+        return changed
+
+    def matching(self, filters: Dict) -> set:
+        """Chunk ids whose metadata matches `filters` ({key: value or list of values})."""
+        result = None
+        for key, values in filters.items():
+            if not isinstance(values, list):
+                values = [values]
+            if not values:
+                continue
+            ids = set()
+            for v in values:
+                ids |= self.meta_index.get((key, meta_value(v)), set())
+            result = ids if result is None else result & ids
+        return result if result is not None else set(self.vectors)
+
+    def doc_freq(self, term_id: int) -> int:
+        entry = self.postings.get(term_id)
+        return len(entry[0]) if entry else 0
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / len(self.lengths) if self.lengths else 0.0
+
+    def texts(self, chunk_ids: Iterable[int]) -> Dict[int, str]:
+        with self.lock:
+            results, missing = {}, []
+            for chunk_id in chunk_ids:
+                text = self._texts.get(chunk_id)
+                if text is None:
+                    missing.append(chunk_id)
+                else:
+                    self._texts.move_to_end(chunk_id)
+                    results[chunk_id] = text
+            conn = self._connection()
+            for batch in _batched(missing):
+                placeholders = ",".join("?" * len(batch))
+                cur = conn.execute(f"SELECT id, chunk_text FROM chunks WHERE id IN ({placeholders})", batch)
+                for chunk_id, text in cur:
+                    results[chunk_id] = text
+                    self._remember_text(chunk_id, text)
+            return results
+
+    def _remember_text(self, chunk_id: int, text: str):
+        self._texts[chunk_id] = text
+        self._text_bytes += sys.getsizeof(text)
+        while self._text_bytes > self.max_text_bytes and len(self._texts) > 1:
+            _, evicted = self._texts.popitem(last=False)
+            self._text_bytes -= sys.getsizeof(evicted)
+
+
+_caches: Dict[str, ChunkCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_path: str = DB_PATH) -> ChunkCache:
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ChunkCache(db_path)
+    return cache
 
-DB_PATH = "rag_demo.sqlite3"
 
 class VectorStore:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
 
-    def _conn(self):
-        return sqlite3.connect(self.db_path)
+    def _read(self) -> sqlite3.Connection:
+        return get_manager(self.db_path).reader()
+
+    def _write(self):
+        return get_manager(self.db_path).writer()
+
+    def cache(self) -> ChunkCache:
+        """Process-wide decoded view of this store, refreshed if the DB changed."""
+        return get_cache(self.db_path).ensure_fresh()
 
     def initialize(self):
-        with self._conn() as conn:
+        with self._write() as conn:
             conn.execute("""
             CREATE TABLE IF NOT EXISTS chunks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,34 +311,347 @@ class VectorStore:
                 created_at REAL
             )
             """)
+            # ChunkCache builds the inverted index in memory from chunk_vectors; the
+            # SQLite postings table of earlier versions was only ever written to
+            conn.execute("DROP TABLE IF EXISTS postings")
+            # the L2 norm of every chunk
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_norms (
+                chunk_id INTEGER PRIMARY KEY,
+                norm REAL NOT NULL
+            )
+            """)
+            # token vectors: interned term ids with packed (term_id, tf) arrays per chunk
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS terms (
+                id INTEGER PRIMARY KEY,
+                term TEXT NOT NULL UNIQUE
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_vectors (
+                chunk_id INTEGER PRIMARY KEY,
+                term_ids BLOB NOT NULL,
+                tfs BLOB NOT NULL
+            )
+            """)
+            # dense embeddings (packed float32) and the embedder that produced them
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                chunk_id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """)
+            # normalized metadata for indexed filtering; one row per (chunk, key, value)
+            has_meta = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunk_meta'").fetchone()
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_meta (
+                chunk_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL
+            )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_meta_key_value ON chunk_meta (key, value)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_meta_chunk ON chunk_meta (chunk_id)")
+            # content hashes of ingested documents and of each of their chunks, for incremental re-ingest
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                updated_at REAL
+            )
+            """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            for column, kind in _ADDED_DOCUMENT_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_text_hash ON documents (text_hash)")
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS document_chunks (
+                doc_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                PRIMARY KEY (doc_id, chunk_index)
+            ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_document_chunks_chunk ON document_chunks (chunk_id)")
+            if not has_meta:
+                self._backfill_meta(conn)
+            self._backfill_index(conn)
+            conn.commit()
+
+    def _backfill_index(self, conn):
+        # move chunks written before the index existed out of tokens_json
+        cur = conn.execute(
+            "SELECT id, tokens_json FROM chunks "
+            "WHERE id NOT IN (SELECT chunk_id FROM chunk_vectors)"
+        )
+        rows = [(chunk_id, json.loads(tokens_json or "{}")) for chunk_id, tokens_json in cur.fetchall()]
+        self._index_vectors(conn, rows)
+        conn.executemany("UPDATE chunks SET tokens_json = '' WHERE id = ?", [(chunk_id,) for chunk_id, _ in rows])
+
+    def _backfill_meta(self, conn):
+        cur = conn.execute("SELECT id, metadata_json FROM chunks")
+        self._index_meta(conn, [(chunk_id, json.loads(metadata_json or "{}")) for chunk_id, metadata_json in cur.fetchall()])
+
+    @staticmethod
+    def _index_meta(conn, rows: List[tuple]):
+        conn.executemany(
+            "INSERT INTO chunk_meta (chunk_id, key, value) VALUES (?, ?, ?)",
+            [(chunk_id, key, value) for chunk_id, metadata in rows for key, value in meta_rows(metadata)]
+        )
+
+    @staticmethod
+    def _intern(conn, terms: List[str]) -> Dict[str, int]:
+        conn.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(t,) for t in terms])
+        return VectorStore._lookup_terms(conn, terms)
+
+    @staticmethod
+    def _lookup_terms(conn, terms: List[str]) -> Dict[str, int]:
+        ids = {}
+        for batch in _batched(terms):
+            placeholders = ",".join("?" * len(batch))
+            cur = conn.execute(f"SELECT term, id FROM terms WHERE term IN ({placeholders})", batch)
+            ids.update(cur.fetchall())
+        return ids
+
+    @staticmethod
+    def _index_vectors(conn, rows: List[tuple]):
+        """Norms and packed vectors for (chunk_id, token counts) rows."""
+        if not rows:
+            return
+        norms = [math.sqrt(sum(v*v for v in tokens.values())) for _, tokens in rows]
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_norms (chunk_id, norm) VALUES (?, ?)",
+            [(chunk_id, norm) for (chunk_id, _), norm in zip(rows, norms)]
+        )
+        ids = VectorStore._intern(conn, list({t for _, tokens in rows for t in tokens}))
+        vectors = []
+        for (chunk_id, tokens), norm in zip(rows, norms):
+            vector = TokenVector.from_counts({ids[t]: tf for t, tf in tokens.items()}, norm)
+            vectors.append((chunk_id, vector.term_ids.tobytes(), vector.tfs.tobytes()))
+        conn.executemany("INSERT OR REPLACE INTO chunk_vectors (chunk_id, term_ids, tfs) VALUES (?, ?, ?)", vectors)
+
+    def insert_chunks(self, chunks: List[str], tokens_list: List[Dict[str,int]], metadata: Dict = None,
+                      embeddings: List[array] = None, embedding_model: str = None,
+                      metadatas: List[Dict] = None, chunk_hashes: List[str] = None) -> Tuple[List[int], List[int]]:
+        """Write chunks and all their index rows in a single transaction.
+
+        `metadata` applies to every chunk; pass `metadatas` for per-chunk metadata.
+        Chunks whose metadata has a "doc_id" are recorded under that document
+        with their `chunk_hashes`. The diff against the stored version is made
+        inside the write transaction: a chunk whose slot (doc_id, chunk_index)
+        already holds the same hash is skipped, and the chunk it replaces is
+        deleted, so concurrent ingests of one document cannot leave orphans.
+        Returns the new chunk ids and the ids of the chunks they replaced.
+        """
+        if metadatas is None:
+            metadatas = [metadata or {}] * len(chunks)
+        if chunk_hashes is None:
+            chunk_hashes = [None] * len(chunks)
+        if embeddings is None:
+            embeddings = [None] * len(chunks)
+        now = time.time()
+        with self._write() as conn:
+            # take the write lock up front: the slots read below and the id range stay ours
+            conn.execute("BEGIN IMMEDIATE")
+            rows, slots, replaced = [], {}, []
+            for row in zip(chunks, tokens_list, metadatas, chunk_hashes, embeddings):
+                md, h = row[2], row[3]
+                if h is None or not md or "doc_id" not in md:
+                    rows.append(row)
+                    continue
+                # a later row for the same slot wins, as it would in a later transaction
+                slots[(str(md["doc_id"]), md.get("chunk_index", 0))] = row
+            for (doc_id, chunk_index), row in slots.items():
+                current = conn.execute(
+                    "SELECT chunk_id, chunk_hash FROM document_chunks WHERE doc_id = ? AND chunk_index = ?",
+                    (doc_id, chunk_index)
+                ).fetchone()
+                if current is not None:
+                    if current[1] == row[3]:
+                        continue
+                    replaced.append(current[0])
+                rows.append(row)
+            self._delete_chunks(conn, replaced)
+            last_id = conn.execute(
+                "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'chunks'), 0), "
+                "COALESCE((SELECT MAX(id) FROM chunks), 0))"
+            ).fetchone()[0]
+            chunk_ids = list(range(last_id + 1, last_id + 1 + len(rows)))
+            conn.executemany(
+                "INSERT INTO chunks (id, chunk_text, tokens_json, metadata_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(cid, chunk, "", json.dumps(md or {}), now) for cid, (chunk, _, md, _, _) in zip(chunk_ids, rows)]
+            )
+            self._index_vectors(conn, [(cid, tokens) for cid, (_, tokens, _, _, _) in zip(chunk_ids, rows)])
+            self._index_meta(conn, [(cid, md) for cid, (_, _, md, _, _) in zip(chunk_ids, rows)])
+            embedded = [(cid, vector) for cid, (_, _, _, _, vector) in zip(chunk_ids, rows) if vector is not None]
+            if embedded:
+                self.store_embeddings(conn, embedded, embedding_model)
+            conn.executemany(
+                "INSERT OR REPLACE INTO document_chunks (doc_id, chunk_index, chunk_id, chunk_hash) "
+                "VALUES (?, ?, ?, ?)",
+                [(str(md["doc_id"]), md.get("chunk_index", 0), cid, h)
+                 for cid, (_, _, md, h, _) in zip(chunk_ids, rows) if h is not None and md and "doc_id" in md]
+            )
             conn.commit()
+        get_cache(self.db_path).mark_stale()
+        return chunk_ids, replaced
+
+    @staticmethod
+    def _delete_chunks(conn, chunk_ids: List[int]):
+        """Remove chunks and every index row that points at them."""
+        for batch in _batched(chunk_ids):
+            placeholders = ",".join("?" * len(batch))
+            for table, column in (("chunks", "id"), ("chunk_vectors", "chunk_id"), ("chunk_norms", "chunk_id"),
+                                  ("chunk_embeddings", "chunk_id"), ("chunk_meta", "chunk_id"),
+                                  ("document_chunks", "chunk_id")):
+                conn.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", batch)
+
+    def document(self, doc_id: str) -> Optional[dict]:
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT content_hash, chunk_count, updated_at FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"doc_id": doc_id, "content_hash": row[0], "chunk_count": row[1], "updated_at": row[2]}
+
+    def document_chunks(self, doc_id: str) -> Dict[int, tuple]:
+        """chunk_index -> (chunk_id, chunk_hash) for a document."""
+        with self._read() as conn:
+            cur = conn.execute(
+                "SELECT chunk_index, chunk_id, chunk_hash FROM document_chunks WHERE doc_id = ?", (doc_id,)
+            )
+            return {index: (chunk_id, h) for index, chunk_id, h in cur.fetchall()}
+
+    def document_with_text(self, text_hash: str) -> Optional[dict]:
+        """A stored document with this text_hash (its text and metadata apart from doc_id), if any."""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT doc_id, content_hash, chunk_count, updated_at FROM documents WHERE text_hash = ? LIMIT 1",
+                (text_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"doc_id": row[0], "content_hash": row[1], "chunk_count": row[2], "updated_at": row[3]}
+
+    def finish_documents(self, rows: List[tuple]) -> List[int]:
+        """Record (doc_id, content_hash, text_hash, chunk_count) once a document's chunks are written.
 
-    def insert_chunks(self, chunks: List[str], tokens_list: List[Dict[str,int]], metadata: Dict = None):
-        metadata_json = json.dumps(metadata or {})
+        Chunks of those documents at chunk_index >= chunk_count are left over
+        from a longer previous version and are deleted. Returns their ids.
+        """
         now = time.time()
-        with self._conn() as conn:
-            for chunk, tokens in zip(chunks, tokens_list):
-                conn.execute(
-                    "INSERT INTO chunks (chunk_text, tokens_json, metadata_json, created_at) VALUES (?, ?, ?, ?)",
-                    (chunk, json.dumps(tokens), metadata_json, now)
-                )
+        with self._write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stale = []
+            for doc_id, _, _, chunk_count in rows:
+                stale.extend(chunk_id for (chunk_id,) in conn.execute(
+                    "SELECT chunk_id FROM document_chunks WHERE doc_id = ? AND chunk_index >= ?",
+                    (doc_id, chunk_count)
+                ))
+            self._delete_chunks(conn, stale)
+            conn.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, content_hash, text_hash, chunk_count, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [tuple(row) + (now,) for row in rows]
+            )
+            conn.commit()
+        if stale:
+            get_cache(self.db_path).mark_stale()
+        return stale
+
+    def delete_document(self, doc_id: str) -> Optional[List[int]]:
+        """Delete a document and its chunks; returns the deleted chunk ids, or None if it is unknown."""
+        with self._write() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            known = conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            chunk_ids = [chunk_id for (chunk_id,) in conn.execute(
+                "SELECT chunk_id FROM document_chunks WHERE doc_id = ?", (doc_id,)
+            )]
+            if not known and not chunk_ids:
+                return None
+            self._delete_chunks(conn, chunk_ids)
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
             conn.commit()
+        get_cache(self.db_path).mark_stale()
+        return chunk_ids
+
+    def documents(self) -> List[dict]:
+        with self._read() as conn:
+            cur = conn.execute("SELECT doc_id, content_hash, chunk_count, updated_at FROM documents ORDER BY doc_id")
+            return [{"doc_id": doc_id, "content_hash": h, "chunk_count": n, "updated_at": updated_at}
+                    for doc_id, h, n, updated_at in cur.fetchall()]
+
+    @staticmethod
+    def store_embeddings(conn, rows, model: str):
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (chunk_id, model, vector) VALUES (?, ?, ?)",
+            [(chunk_id, model, vector.tobytes()) for chunk_id, vector in rows]
+        )
 
     def all_chunks(self):
-        with self._conn() as conn:
-            cur = conn.execute("SELECT id, chunk_text, tokens_json, metadata_json FROM chunks")
+        with self._read() as conn:
+            cur = conn.execute(
+                "SELECT c.id, c.chunk_text, v.term_ids, v.tfs, n.norm, c.metadata_json FROM chunks c "
+                "JOIN chunk_vectors v ON v.chunk_id = c.id "
+                "JOIN chunk_norms n ON n.chunk_id = c.id"
+            )
             rows = cur.fetchall()
         results = []
         for r in rows:
             results.append({
                 "id": r[0],
                 "chunk": r[1],
-                "tokens": json.loads(r[2]),
-                "metadata": json.loads(r[3] or "{}")
+                "tokens": TokenVector.from_blobs(r[2], r[3], r[4]),
+                "metadata": json.loads(r[5] or "{}")
             })
         return results
 
+    def encode(self, tokens: Dict[str, int]) -> TokenVector:
+        """Map a query's token counts onto stored term ids.
+
+        Terms that never occur in the store are dropped from the vector but
+        still count towards its norm, so cosine scores are unchanged.
+        """
+        with self._read() as conn:
+            ids = self._lookup_terms(conn, list(tokens))
+        norm = math.sqrt(sum(v*v for v in tokens.values()))
+        return TokenVector.from_counts({ids[t]: tf for t, tf in tokens.items() if t in ids}, norm)
+
+    def chunks_by_ids(self, chunk_ids: Iterable[int]) -> Dict[int, dict]:
+        chunk_ids = list(chunk_ids)
+        results = {}
+        with self._read() as conn:
+            for batch in _batched(chunk_ids):
+                placeholders = ",".join("?" * len(batch))
+                cur = conn.execute(
+                    f"SELECT id, chunk_text, metadata_json FROM chunks WHERE id IN ({placeholders})",
+                    batch
+                )
+                for chunk_id, chunk_text, metadata_json in cur.fetchall():
+                    results[chunk_id] = {
+                        "id": chunk_id,
+                        "chunk": chunk_text,
+                        "metadata": json.loads(metadata_json or "{}")
+                    }
+        return results
+
     def clear(self):
-        with self._conn() as conn:
+        with self._write() as conn:
             conn.execute("DELETE FROM chunks")
+            conn.execute("DELETE FROM chunk_norms")
+            conn.execute("DELETE FROM chunk_vectors")
+            conn.execute("DELETE FROM terms")
+            conn.execute("DELETE FROM chunk_embeddings")
+            conn.execute("DELETE FROM chunk_meta")
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM document_chunks")
             conn.commit()
+        get_cache(self.db_path).drop()
+        if os.path.exists(ann_index_path(self.db_path)):
+            os.remove(ann_index_path(self.db_path))
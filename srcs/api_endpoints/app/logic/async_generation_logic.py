@@ -0,0 +1,134 @@
+"""Async counterparts of generation_logic for the ASGI serving path.
+
+One AsyncOpenAI client per process shares a pooled httpx connection to
+Featherless, and a semaphore caps the number of upstream calls in flight.
+Prompts, model and the response cache are the same as the sync path.
+"""
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Iterable, List
+
+from .coalescing import AsyncSingleFlight
+from .generation_logic import (
+    DATA_BATCH_WINDOW_MS, FEATHERLESS_BASE_URL, MODEL_NAME, api_key, build_prompt, build_data_prompt,
+    get_data_batcher, parse_structured_data, record_usage,
+)
+from .metrics import metrics
+from ..db.response_cache import cache_key, get_response_cache
+
+# upstream calls allowed in flight per worker process; also sizes the connection pool
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+
+_client = None
+_semaphore = None
+_flight = AsyncSingleFlight()
+
+
+def get_async_client():
+    global _client
+    if _client is None:
+        # imported here like the sync client, to keep them out of worker boot
+        import httpx
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                max_keepalive_connections=LLM_MAX_CONCURRENCY),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        _client = AsyncOpenAI(
+            base_url=FEATHERLESS_BASE_URL,
+            api_key=api_key(),
+            http_client=http_client,
+        )
+    return _client
+
+
+def _limit() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def _acomplete(system_text: str, user_text: str, max_tokens: int, chunk_ids: Iterable[int] = ()) -> str:
+    cache = get_response_cache()
+    key = cache_key(MODEL_NAME, system_text, user_text, max_tokens)
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        return cached
+
+    async def call() -> str:
+        async with _limit():
+            start = time.perf_counter()
+            response = await get_async_client().chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": system_text},
+                    {"role": "user", "content": user_text},
+                ],
+                max_tokens=max_tokens,
+                temperature=0.0,
+            )
+            metrics.observe("llm.completion", time.perf_counter() - start)
+        content = response.choices[0].message.content
+        record_usage(response.usage, system_text, user_text, content)
+        await asyncio.to_thread(cache.put, key, content, list(chunk_ids))
+        return content
+
+    return await _flight.do(key, call)
+
+
+async def agenerate_answer(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()) -> str:
+    system_text, user_text = build_prompt(question, context_chunks)
+    return await _acomplete(system_text, user_text, 300, chunk_ids)
+
+
+async def astream_answer(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()) -> AsyncIterator[str]:
+    system_text, user_text = build_prompt(question, context_chunks)
+
+    cache = get_response_cache()
+    key = cache_key(MODEL_NAME, system_text, user_text, 300)
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        yield cached
+        return
+
+    parts = []
+    async with _limit():
+        start = time.perf_counter()
+        stream = await get_async_client().chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": system_text},
+                {"role": "user", "content": user_text},
+            ],
+            max_tokens=300,
+            temperature=0.0,
+            stream=True,
+        )
+        metrics.observe("llm.stream_open", time.perf_counter() - start)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    record_usage(None, system_text, user_text, "".join(parts))
+    await asyncio.to_thread(cache.put, key, "".join(parts), list(chunk_ids))
+
+
+async def agenerate_structured_data(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()):
+    if DATA_BATCH_WINDOW_MS > 0:
+        # batches are answered by the sync client on the batcher's threads
+        future = get_data_batcher().submit((question, context_chunks, list(chunk_ids)))
+        return await asyncio.wrap_future(future)
+
+    system_text, user_text = build_data_prompt(question, context_chunks)
+    raw = await _acomplete(system_text, user_text, 500, chunk_ids)
+    return parse_structured_data(raw)
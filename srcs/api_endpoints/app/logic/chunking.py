@@ -0,0 +1,166 @@
+"""Streaming sentence chunker that emits chunks with their index token counts.
+
+Text arrives in pieces (see to_txt_conversion.iter_text). Only the
+unfinished sentence is buffered between pieces, so memory stays flat
+however large the document is and each character is scanned about once.
+Every emitted chunk carries its token counts, which equal
+retrieval_logic.token_counts(chunk.text), so ingest never tokenizes a
+chunk a second time.
+
+Chunks are sized in words (the default, as chunk_text always did) or in
+index tokens (CHUNK_UNIT=tokens). Consecutive chunks overlap by
+CHUNK_OVERLAP units.
+"""
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from .retrieval_logic import TOKEN_RE
+
+# This regex splits on ., !, ?, but keeps abbreviations intact
+SENTENCE_ENDINGS = re.compile(r'(?<=[.!?])\s+')
+# text without a sentence ending is cut at whitespace past this size (spreadsheets, transcripts)
+MAX_SENTENCE_CHARS = 20000
+
+CHUNK_UNITS = ("words", "tokens")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 75))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 10))
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "words")
+
+
+class Chunk(NamedTuple):
+    text: str
+    tokens: Dict[str, int]  # index token counts of `text`
+
+
+def split_sentences(text: str) -> List[str]:
+    sentences = SENTENCE_ENDINGS.split(text)
+    return [s.strip() for s in sentences if s.strip()]
+
+
+def _cut_long(text: str, start: int, end: int) -> Tuple[List[str], int]:
+    """Cut text[start:end] at whitespace while it is longer than MAX_SENTENCE_CHARS.
+
+    Returns the parts cut off and the offset where the rest begins.
+    """
+    parts = []
+    while end - start > MAX_SENTENCE_CHARS:
+        limit = start + MAX_SENTENCE_CHARS
+        cut = max(text.rfind(" ", start, limit), text.rfind("\n", start, limit), text.rfind("\t", start, limit))
+        if cut <= start:
+            break
+        parts.append(text[start:cut])
+        start = cut + 1
+    return parts, start
+
+
+def _stripped(parts: List[str]) -> Iterator[str]:
+    for part in parts:
+        part = part.strip()
+        if part:
+            yield part
+
+
+def iter_sentences(pieces: Iterable[str]) -> Iterator[str]:
+    """Sentences of the concatenated pieces, in order; only the unfinished sentence is buffered."""
+    buffer = ""
+    for piece in pieces:
+        text = buffer + piece
+        start = 0
+        # the buffer holds no sentence ending, so only the new piece is searched
+        # (the lookbehind still sees the buffer's last character)
+        for match in SENTENCE_ENDINGS.finditer(text, len(buffer)):
+            end = match.start()
+            if end - start > MAX_SENTENCE_CHARS:
+                parts, start = _cut_long(text, start, end)
+                yield from _stripped(parts)
+            sentence = text[start:end].strip()
+            if sentence:
+                yield sentence
+            start = match.end()
+        buffer = text[start:]
+        if len(buffer) > MAX_SENTENCE_CHARS:
+            # an unfinished sentence that is already too long gives up its head
+            parts, rest = _cut_long(buffer, 0, len(buffer))
+            yield from _stripped(parts)
+            buffer = buffer[rest:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def stream_chunks(pieces: Iterable[str], size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                  unit: str = CHUNK_UNIT) -> Iterator[Chunk]:
+    """Chunks of streamed text with their token counts, yielded as soon as they are complete."""
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"Unknown chunk unit {unit!r}, expected one of {CHUNK_UNITS}")
+    by_words = unit == "words"
+    words: List[str] = []
+    used = 0
+    # the first `known` words came over from the previous chunk, already tokenized
+    known, known_tokens = 0, []
+
+    for sentence in iter_sentences(pieces):
+        sentence_words = sentence.split()
+        n = len(sentence_words) if by_words else len(TOKEN_RE.findall(sentence))
+
+        if used + n > size and words:
+            tail, tail_used = _tail(words, overlap, by_words)
+            chunk, known_tokens = _finish(words, known, known_tokens, len(tail))
+            yield chunk
+            words, used, known = tail, tail_used, len(tail)
+
+        words.extend(sentence_words)
+        used += n
+
+    if words:
+        yield _finish(words, known, known_tokens, 0)[0]
+
+
+def _finish(words: List[str], known: int, known_tokens: List[str], n_tail: int) -> Tuple[Chunk, List[str]]:
+    """The chunk of `words`, and the tokens of its last `n_tail` words, which open the next chunk.
+
+    The first `known` words come with their `known_tokens`; the rest are
+    tokenized here, split where the tail starts, so a word is tokenized once
+    however many chunks it ends up in. Tokens never span whitespace, so the
+    spans are cut from the chunk text by offset.
+    """
+    text = " ".join(words)
+    new_start = sum(map(len, words[:known])) + known
+    if not n_tail:
+        tokens = known_tokens + TOKEN_RE.findall(text[new_start:].lower())
+        return Chunk(text, dict(Counter(tokens))), []
+    tail_start = len(text) - sum(map(len, words[-n_tail:])) - n_tail + 1
+    if tail_start >= new_start:
+        head_tokens = TOKEN_RE.findall(text[new_start:tail_start].lower())
+        tail_tokens = TOKEN_RE.findall(text[tail_start:].lower())
+        tokens = known_tokens + head_tokens + tail_tokens
+    else:
+        # the tail reaches back into the carried words (a short sentence before a long one)
+        tokens = known_tokens + TOKEN_RE.findall(text[new_start:].lower())
+        tail_tokens = TOKEN_RE.findall(text[tail_start:].lower())
+    return Chunk(text, dict(Counter(tokens))), tail_tokens
+
+
+def _tail(words: List[str], overlap: int, by_words: bool) -> Tuple[List[str], int]:
+    """The last `overlap` units of a finished chunk, which open the next one, and their size."""
+    if overlap <= 0:
+        return [], 0
+    if by_words:
+        tail = words[-overlap:] if overlap < len(words) else words
+        return tail, len(tail)
+    n = used = 0
+    while n < len(words) and used < overlap:
+        n += 1
+        used += len(TOKEN_RE.findall(words[-n]))
+    return words[-n:], used
+
+
+def iter_chunks(pieces: Iterable[str], size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                unit: str = CHUNK_UNIT) -> Iterator[str]:
+    for chunk in stream_chunks(pieces, size, overlap, unit):
+        yield chunk.text
+
+
+def chunk_text(text: str, chunk_size_words: int = 75, overlap_words: int = 10) -> List[str]:
+    return list(iter_chunks([text], chunk_size_words, overlap_words, "words"))
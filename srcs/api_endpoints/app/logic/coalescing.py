@@ -0,0 +1,127 @@
+"""Request coalescing for upstream LLM calls.
+
+SingleFlight / AsyncSingleFlight let concurrent callers with the same key
+share one in-flight call. MicroBatcher collects items for a short window
+and hands them to a batch function together.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future)
+
+        self.stats["calls"] += 1
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved in case nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+class MicroBatcher:
+    """Groups items submitted within `window` seconds (at most `max_batch`) into one `run_batch` call.
+
+    `run_batch` receives a list of items and must return one result per item, in order.
+    """
+
+    def __init__(self, run_batch: Callable[[List[Any]], List[Any]], window: float, max_batch: int,
+                 workers: int = 4):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._timer = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="microbatch")
+        self.stats = {"items": 0, "batches": 0}
+
+    def submit(self, item: Any) -> Future:
+        future = Future()
+        batch = None
+        with self._lock:
+            self._pending.append((item, future))
+            self.stats["items"] += 1
+            if len(self._pending) >= self.max_batch:
+                batch = self._take()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._executor.submit(self._run, batch)
+        return future
+
+    def _take(self) -> List[tuple]:
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            batch, self._pending = self._pending, []
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch: List[tuple]):
+        with self._lock:
+            self.stats["batches"] += 1
+        try:
+            results = self.run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
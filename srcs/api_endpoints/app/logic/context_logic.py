@@ -0,0 +1,130 @@
+"""Assemble retrieved chunks into a prompt context that fits a token budget.
+
+Adjacent chunks of the same versioned document (same `doc_id`) are merged,
+dropping the words `chunk_text` repeats as overlap; every other chunk is a
+block of its own, since equal metadata says nothing about a shared source.
+Only a chunk whose text repeats one already kept is dropped. Blocks are
+kept in retrieval order (best-ranked member first) and added until CONTEXT_TOKEN_BUDGET is used up.
+Tokens are counted with tiktoken when it is installed, otherwise estimated.
+"""
+import os
+from typing import Dict, List, Tuple
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+# a partial block shorter than this is not worth sending
+MIN_BLOCK_TOKENS = 32
+# chunks overlap by CHUNK_OVERLAP (10) words, or a whole short chunk
+MAX_OVERLAP_WORDS = 100
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # not installed, or the encoding file can't be fetched
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    # roughly 4 characters per token for English-like text
+    return (len(text) + 3) // 4
+
+
+def prompt_tokens(system_text: str, user_text: str) -> int:
+    return count_tokens(system_text) + count_tokens(user_text)
+
+
+def _document_key(metadata: dict):
+    if "chunk_index" not in metadata or metadata.get("doc_id") is None:
+        return None
+    return str(metadata["doc_id"])
+
+
+def _overlap(left: List[str], right: List[str]) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for n in range(min(len(left), len(right), MAX_OVERLAP_WORDS), 0, -1):
+        if left[-n:] == right[:n]:
+            return n
+    return 0
+
+
+def _merge_blocks(retrieved: List[dict]) -> List[List[str]]:
+    """Word lists of merged blocks, ordered by the best rank among their chunks."""
+    blocks: List[Tuple[int, List[str]]] = []  # (rank, words)
+    runs: Dict[str, List[Tuple[int, int, List[str]]]] = {}  # document -> [(chunk_index, rank, words)]
+    for rank, r in enumerate(retrieved):
+        words = r["chunk"].split()
+        doc = _document_key(r.get("metadata") or {})
+        if doc is None:
+            blocks.append((rank, words))
+        else:
+            runs.setdefault(doc, []).append((int(r["metadata"]["chunk_index"]), rank, words))
+
+    for parts in runs.values():
+        parts.sort()
+        prev_index, rank, words = parts[0]
+        prev_words = words
+        for index, r_rank, r_words in parts[1:]:
+            if index == prev_index:
+                # another version of the same slot is a block of its own
+                if r_words != prev_words:
+                    blocks.append((r_rank, r_words))
+                continue
+            if index == prev_index + 1:
+                words = words + r_words[_overlap(words, r_words):]
+                rank = min(rank, r_rank)
+            else:
+                blocks.append((rank, words))
+                rank, words = r_rank, r_words
+            prev_index, prev_words = index, r_words
+        blocks.append((rank, words))
+
+    blocks.sort(key=lambda b: b[0])
+    seen = set()
+    unique = []
+    for _, words in blocks:
+        text = " ".join(words)
+        if text not in seen:
+            seen.add(text)
+            unique.append(words)
+    return unique
+
+
+def _truncate(words: List[str], budget: int) -> str:
+    """Longest prefix of `words` that fits in `budget` tokens."""
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo])
+
+
+def assemble_context(retrieved: List[dict], budget: int = None) -> Tuple[List[str], int]:
+    """Return (context blocks, their token count) built from `retrieve()` results within `budget` tokens."""
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    context, used = [], 0
+    for words in _merge_blocks(retrieved):
+        text = " ".join(words)
+        tokens = count_tokens(text)
+        if used + tokens > budget:
+            remaining = budget - used
+            if remaining >= MIN_BLOCK_TOKENS or not context:
+                text = _truncate(words, remaining)
+                if text:
+                    context.append(text)
+                    used += count_tokens(text)
+            break
+        context.append(text)
+        used += tokens
+    return context, used
@@ -0,0 +1,77 @@
+import math
+import os
+import zlib
+from array import array
+from typing import List
+
+from . import retrieval_logic  # for token functions
+
+# "hashing" (default, no extra dependencies) or a sentence-transformers model name,
+# e.g. "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "hashing")
+EMBED_BATCH_SIZE = 64
+# embed chunks as they are ingested; otherwise the dense index embeds them in the
+# background the first time a dense or hybrid query needs them
+EMBED_ON_INGEST = int(os.getenv("EMBED_ON_INGEST", 0))
+
+
+class HashingEmbedder:
+    """Deterministic stand-in for a real model: signed feature hashing of words
+    and in-word character trigrams into a fixed number of dimensions.
+    Trigrams let inflected Czech word forms land close to each other."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str):
+        for tok in retrieval_logic.tokens(text):
+            yield tok, 1.0
+            padded = f"#{tok}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def embed(self, texts: List[str]) -> List[array]:
+        vectors = []
+        for text in texts:
+            vec = [0.0] * self.dim
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vec[h % self.dim] += weight if h & 0x80000000 else -weight
+            norm = math.sqrt(sum(v * v for v in vec))
+            vectors.append(array("f", (v / norm for v in vec) if norm else vec))
+        return vectors
+
+
+class SentenceTransformerEmbedder:
+    """Local CPU model through sentence-transformers (optional dependency)."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts: List[str]) -> List[array]:
+        encoded = self.model.encode(texts, batch_size=EMBED_BATCH_SIZE, normalize_embeddings=True)
+        return [array("f", v.tolist()) for v in encoded]
+
+
+_embedder = None
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_MODEL == "hashing":
+            _embedder = HashingEmbedder()
+        else:
+            _embedder = SentenceTransformerEmbedder(EMBEDDING_MODEL)
+    return _embedder
+
+
+def embed_batched(texts: List[str]) -> List[array]:
+    embedder = get_embedder()
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(embedder.embed(texts[i:i + EMBED_BATCH_SIZE]))
+    return vectors
@@ -1,21 +1,51 @@
+import json
 import os
-from typing import List
-from openai import OpenAI
+import threading
+from typing import Iterable, Iterator, List
+from .coalescing import MicroBatcher, SingleFlight
+from .context_logic import count_tokens, prompt_tokens
+from .metrics import metrics, timed, timed_iter
+from ..db.response_cache import cache_key, get_response_cache
 
-# Ensure your Featherless API key is available
+# Featherless API key; checked when the first completion is requested
 FEATHERLESS_API_KEY = os.getenv("FEATHERLESS_API_KEY")
-if not FEATHERLESS_API_KEY:
-    raise ValueError("Missing FEATHERLESS_API_KEY environment variable.")
 
-# Initialize the client for Featherless AI
-client = OpenAI(
-    base_url="https://api.featherless.ai/v1",
-    api_key=FEATHERLESS_API_KEY,
-)
+# OpenAI-compatible endpoint; the benchmarks point this at a local stub
+FEATHERLESS_BASE_URL = os.getenv("FEATHERLESS_BASE_URL", "https://api.featherless.ai/v1")
+
+# the openai package takes most of a second to import, so the client is built on first use
+_client = None
+_client_lock = threading.Lock()
 
 # Choose the model
 MODEL_NAME = "unsloth/Llama-3.3-70B-Instruct"
 
+# micro-batching of /generate-data calls; a window of 0 disables it
+DATA_BATCH_WINDOW_MS = float(os.getenv("DATA_BATCH_WINDOW_MS", 0))
+DATA_BATCH_MAX_SIZE = int(os.getenv("DATA_BATCH_MAX_SIZE", 8))
+
+# identical prompts in flight at the same time share one upstream call
+_flight = SingleFlight()
+
+
+def api_key() -> str:
+    if not FEATHERLESS_API_KEY:
+        raise ValueError("Missing FEATHERLESS_API_KEY environment variable.")
+    return FEATHERLESS_API_KEY
+
+
+def get_client():
+    """The Featherless AI client (OpenAI-compatible SDK), created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(
+                base_url=FEATHERLESS_BASE_URL,
+                api_key=api_key(),
+            )
+        return _client
+
 
 def build_prompt(question: str, context_chunks: List[str]) -> (str, str):
     """Return system_text and user_text for the model."""
@@ -33,21 +63,82 @@ def build_prompt(question: str, context_chunks: List[str]) -> (str, str):
     return system_text, user_text
 
 
-def generate_answer(question: str, context_chunks: List[str]) -> str:
+def record_usage(usage, system_text: str, user_text: str, completion: str):
+    """Count one upstream call's tokens, from the API's usage report or estimated when it has none."""
+    metrics.inc("rag_llm_calls_total")
+    metrics.inc("rag_llm_prompt_tokens_total",
+                getattr(usage, "prompt_tokens", None) or prompt_tokens(system_text, user_text))
+    metrics.inc("rag_llm_completion_tokens_total",
+                getattr(usage, "completion_tokens", None) or count_tokens(completion))
+
+
+def _complete(system_text: str, user_text: str, max_tokens: int, chunk_ids: Iterable[int] = ()) -> str:
+    """One deterministic completion, served from the response cache when the same prompt was seen before."""
+    cache = get_response_cache()
+    key = cache_key(MODEL_NAME, system_text, user_text, max_tokens)
+    with timed("llm.cache"):
+        cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    def call() -> str:
+        with timed("llm.completion"):
+            response = get_client().chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": system_text},
+                    {"role": "user", "content": user_text},
+                ],
+                max_tokens=max_tokens,
+                temperature=0.0,
+            )
+        content = response.choices[0].message.content
+        record_usage(response.usage, system_text, user_text, content)
+        cache.put(key, content, chunk_ids)
+        return content
+
+    return _flight.do(key, call)
+
+
+def generate_answer(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()) -> str:
     """Query Featherless AI through OpenAI-compatible SDK."""
     system_text, user_text = build_prompt(question, context_chunks)
+    return _complete(system_text, user_text, 300, chunk_ids)
 
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "system", "content": system_text},
-            {"role": "user", "content": user_text},
-        ],
-        max_tokens=300,
-        temperature=0.0,
-    )
 
-    return response.choices[0].message.content
+def stream_answer(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()) -> Iterator[str]:
+    """Like generate_answer, but yields text deltas as the model produces them."""
+    system_text, user_text = build_prompt(question, context_chunks)
+
+    # a cached answer goes out in one piece
+    cache = get_response_cache()
+    key = cache_key(MODEL_NAME, system_text, user_text, 300)
+    with timed("llm.cache"):
+        cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    with timed("llm.stream_open"):
+        stream = get_client().chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "system", "content": system_text},
+                {"role": "user", "content": user_text},
+            ],
+            max_tokens=300,
+            temperature=0.0,
+            stream=True,
+        )
+
+    parts = []
+    for chunk in timed_iter("llm.stream", stream):
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    record_usage(None, system_text, user_text, "".join(parts))
+    # only complete streams are cached
+    cache.put(key, "".join(parts), chunk_ids)
 
 def build_data_prompt(question: str, context_chunks: List[str]) -> (str, str):
     context_text = "\n\n---\n\n".join(context_chunks)
@@ -63,23 +154,98 @@ def build_data_prompt(question: str, context_chunks: List[str]) -> (str, str):
     return system_text, user_text
 
 
-def generate_structured_data(question: str, context_chunks: List[str]):
+def build_batch_data_prompt(tasks: List[tuple]) -> (str, str):
+    """One prompt for several (question, context_chunks) tasks; the model answers with a JSON object keyed by task number."""
+    system_text = (
+        "You are a data-generation assistant. "
+        "You will receive several numbered tasks, each with its own context and question. "
+        "For each task, using ONLY that task's context, generate a dataset as a JSON list of objects, "
+        "each representing a row. "
+        "Return STRICTLY one JSON object mapping each task number (as a string) to its list. "
+        "Do not add explanations, comments, or extra text. "
+        "If data cannot be extracted for a task, use []."
+    )
+
+    parts = []
+    for i, (question, context_chunks) in enumerate(tasks, start=1):
+        context_text = "\n\n---\n\n".join(context_chunks)
+        parts.append(f"Task {i}:\nContext:\n{context_text}\n\nQuestion: {question}")
+    user_text = "\n\n===\n\n".join(parts) + "\n\nReturn ONLY valid JSON:"
+    return system_text, user_text
+
+
+def _run_data_batch(items: List[tuple]) -> list:
+    """Answer a batch of (question, context_chunks, chunk_ids) in as few upstream calls as possible."""
+    cache = get_response_cache()
+    results = [None] * len(items)
+    pending = {}  # cache key -> (prompt, indexes into items)
+    for i, (question, context_chunks, chunk_ids) in enumerate(items):
+        system_text, user_text = build_data_prompt(question, context_chunks)
+        key = cache_key(MODEL_NAME, system_text, user_text, 500)
+        cached = cache.get(key)
+        if cached is not None:
+            results[i] = parse_structured_data(cached)
+        else:
+            pending.setdefault(key, ((system_text, user_text), []))[1].append(i)
+
+    if len(pending) == 1:
+        (key, ((system_text, user_text), indexes)), = pending.items()
+        data = parse_structured_data(_complete(system_text, user_text, 500, items[indexes[0]][2]))
+        for i in indexes:
+            results[i] = data
+    elif pending:
+        groups = list(pending.items())
+        tasks = [(items[indexes[0]][0], items[indexes[0]][1]) for _, (_, indexes) in groups]
+        all_chunk_ids = sorted({c for _, (_, indexes) in groups for c in items[indexes[0]][2]})
+        system_text, user_text = build_batch_data_prompt(tasks)
+        try:
+            answers = json.loads(_complete(system_text, user_text, 500 * len(tasks), all_chunk_ids).strip())
+        except json.JSONDecodeError:
+            answers = None
+
+        for n, (key, ((single_system, single_user), indexes)) in enumerate(groups, start=1):
+            if isinstance(answers, dict) and isinstance(answers.get(str(n)), list):
+                data = answers[str(n)]
+                # cached under the single-question key so later calls hit without batching
+                cache.put(key, json.dumps(data), items[indexes[0]][2])
+            else:
+                data = parse_structured_data(_complete(single_system, single_user, 500, items[indexes[0]][2]))
+            for i in indexes:
+                results[i] = data
+    return results
+
+
+_data_batcher = None
+
+
+def get_data_batcher() -> MicroBatcher:
+    global _data_batcher
+    if _data_batcher is None:
+        _data_batcher = MicroBatcher(_run_data_batch, DATA_BATCH_WINDOW_MS / 1000.0, DATA_BATCH_MAX_SIZE)
+    return _data_batcher
+
+
+def coalescing_stats() -> dict:
+    stats = {"single_flight": dict(_flight.stats)}
+    if _data_batcher is not None:
+        stats["data_batches"] = dict(_data_batcher.stats)
+    return stats
+
+
+def generate_structured_data(question: str, context_chunks: List[str], chunk_ids: Iterable[int] = ()):
+    if DATA_BATCH_WINDOW_MS > 0:
+        return get_data_batcher().submit((question, context_chunks, list(chunk_ids))).result()
+
     system_text, user_text = build_data_prompt(question, context_chunks)
 
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {"role": "system", "content": system_text},
-            {"role": "user", "content": user_text},
-        ],
-        max_tokens=500,
-        temperature=0.0,
-    )
+    raw = _complete(system_text, user_text, 500, chunk_ids)
+    return parse_structured_data(raw)
+
 
-    raw = response.choices[0].message.content.strip()
+def parse_structured_data(raw: str) -> list:
+    raw = raw.strip()
 
     # Parse JSON safely
-    import json
     try:
         data = json.loads(raw)
         if isinstance(data, list):
@@ -1,59 +1,295 @@
-import re
-from typing import List, Dict
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Optional, Tuple
 from . import retrieval_logic  # for token functions
-from ..db.vector_store import VectorStore
+from . import embedding_logic
+from .chunking import Chunk, stream_chunks
+from .metrics import metrics, timed, timed_iter
+from ..db.vector_store import DB_PATH, VectorStore
+from ..db.response_cache import ResponseCache, get_response_cache
 
-# simple chunker: split by sentences and group to approx chunk_size words
-def split_sentences(text: str) -> List[str]:
-    # This regex splits on ., !, ?, but keeps abbreviations intact
-    sentence_endings = re.compile(r'(?<=[.!?])\s+')
-    sentences = sentence_endings.split(text)
-    return [s.strip() for s in sentences if s.strip()]
+# chunks written per transaction when ingesting a stream
+STREAM_CHUNKS_PER_BATCH = 1000
 
+# doc_id -> [lock, number of ingests holding or waiting for it]
+_doc_locks: Dict[str, list] = {}
+_doc_locks_guard = threading.Lock()
 
-def chunk_text(text: str, chunk_size_words: int = 75, overlap_words: int = 10) -> List[str]:
-    sentences = split_sentences(text)
-    chunks = []
-    current_chunk = []
-    current_len = 0
 
-    for sentence in sentences:
-        words_in_sentence = sentence.split()
-        sentence_len = len(words_in_sentence)
+def tokenize(text: str) -> Dict[str,int]:
+    # reuse retrieval logic's tokenizer for consistent tokens
+    return retrieval_logic.token_counts(text)
 
-        if current_len + sentence_len > chunk_size_words and current_chunk:
-            chunks.append(" ".join(current_chunk))
-            # For overlap, keep last `overlap_words` words
-            overlap = current_chunk[-overlap_words:] if overlap_words < len(current_chunk) else current_chunk
-            current_chunk = overlap.copy()
-            current_len = len(current_chunk)
+def content_hash(text: str, metadata: dict = None) -> str:
+    """Hash identifying a document version: its metadata plus its full text."""
+    digest = _document_digest(metadata)
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
 
-        current_chunk.extend(words_in_sentence)
-        current_len += sentence_len
 
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
+def text_hash(text: str, metadata: dict = None) -> str:
+    """Hash of a document's text and metadata apart from its doc_id: equal for the same content under any doc_id."""
+    digest = _text_digest(metadata)
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
 
-    return chunks
 
-def tokenize(text: str) -> Dict[str,int]:
-    # reuse retrieval logic's tokenizer for consistent tokens
-    return retrieval_logic.token_counts(text)
+def _document_digest(metadata: dict = None):
+    return hashlib.sha256(json.dumps(metadata or {}, sort_keys=True, default=str).encode("utf-8"))
 
-def ingest_document(text: str, metadata: dict = None) -> dict:
-    chunks = chunk_text(text)
-    store = VectorStore()
-    inserted_count = 0
 
+def _text_digest(metadata: dict = None):
+    return _document_digest({k: v for k, v in (metadata or {}).items() if k != "doc_id"})
+
+
+def chunk_hash(chunk: str, chunk_metadata: dict) -> str:
+    raw = json.dumps([chunk, chunk_metadata], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _doc_id(metadata: dict = None):
+    doc_id = (metadata or {}).get("doc_id")
+    return None if doc_id is None else str(doc_id)
+
+
+def _diff_chunks(chunks: Iterable[Chunk], metadata: dict, previous: Dict[int, tuple], counts: dict):
+    """Yield (chunk, chunk_metadata, chunk_hash) for chunks not already stored.
+
+    `previous` is the stored version of the document (chunk_index -> (chunk_id, chunk_hash));
+    `counts` collects the number of chunks seen and left unchanged.
+    """
     for i, chunk in enumerate(chunks):
-        tokens = tokenize(chunk)
         # Optionally, you can add per-chunk metadata
         chunk_metadata = metadata.copy() if metadata else {}
         chunk_metadata.update({"chunk_index": i})
-        store.insert_chunks([chunk], [tokens], metadata=chunk_metadata)
-        inserted_count += 1
+        h = chunk_hash(chunk.text, chunk_metadata)
+        counts["total"] += 1
+        old = previous.get(i)
+        if old is not None and old[1] == h:
+            counts["unchanged"] += 1
+            continue
+        yield chunk, chunk_metadata, h
+
+
+def _write_rows(store: VectorStore, rows: List[tuple]) -> Tuple[int, List[int]]:
+    """Insert (Chunk, chunk_metadata, chunk_hash) rows in one transaction.
+
+    Returns the number of chunks written and the ids of the chunks they replaced.
+    The store re-checks each slot inside its transaction, so a row another
+    ingest already wrote is skipped and the replaced ids are the current ones.
+    """
+    if not rows:
+        return 0, []
+    # the chunker already counted the tokens of each chunk
+    chunks = [chunk.text for chunk, _, _ in rows]
+    tokens_list = [chunk.tokens for chunk, _, _ in rows]
+    embeddings = None
+    if embedding_logic.EMBED_ON_INGEST:
+        with timed("ingest.embed"):
+            # dense vectors for the whole batch, computed in batches
+            embeddings = embedding_logic.embed_batched(chunks)
+    with timed("ingest.write"):
+        chunk_ids, replaced = store.insert_chunks(
+            chunks, tokens_list,
+            metadatas=[md for _, md, _ in rows],
+            chunk_hashes=[h for _, _, h in rows],
+            embeddings=embeddings,
+            embedding_model=embedding_logic.get_embedder().name if embeddings is not None else None,
+        )
+    metrics.inc("rag_ingest_chunks_total", len(chunk_ids))
+    return len(chunk_ids), replaced
+
+
+@contextmanager
+def _document_lock(doc_id: Optional[str]):
+    """Serialize ingests of one doc_id within this process.
+
+    Across processes the store's per-slot diff still keeps the chunks
+    consistent; this lock stops two threads from interleaving their batches.
+    """
+    if doc_id is None:
+        yield
+        return
+    with _doc_locks_guard:
+        entry = _doc_locks.setdefault(doc_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _doc_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _doc_locks[doc_id]
+
+
+def _invalidate(chunk_ids: List[int], db_path: str = DB_PATH):
+    if not chunk_ids:
+        return
+    if db_path == DB_PATH:
+        cache = get_response_cache()
+    else:
+        cache = ResponseCache(db_path)
+        cache.initialize()
+    cache.invalidate_chunks(chunk_ids)
+
+
+def ingest_document(text: str, metadata: dict = None) -> dict:
+    """Chunk, index and store one document in a single transaction.
+
+    Documents with a "doc_id" in their metadata are versioned: re-ingesting
+    an unchanged document is skipped, and a changed one only replaces the
+    chunks that differ.
+    """
+    doc_id = _doc_id(metadata)
+    if doc_id is not None:
+        stored = VectorStore().document(doc_id)
+        if stored is not None and stored["content_hash"] == content_hash(text, metadata):
+            return {
+                "inserted_chunks": 0,
+                "unchanged_chunks": stored["chunk_count"],
+                "deleted_chunks": 0,
+                "status": "unchanged"
+            }
+    # all rows go in with one transaction
+    return ingest_stream([text], metadata, chunks_per_batch=None)
+
+
+def ingest_stream(pieces: Iterable[str], metadata: dict = None,
+                  chunks_per_batch: Optional[int] = STREAM_CHUNKS_PER_BATCH, dedup: bool = False) -> dict:
+    """Like ingest_document, for text produced piece by piece (see to_txt_conversion.iter_text).
+
+    Chunks are written every `chunks_per_batch`, so memory does not grow with
+    the document; a failure part-way leaves the batches already written.
+
+    With `dedup` (for a doc_id the caller made up rather than one that names
+    the document), text already stored under another doc_id is not ingested
+    again: the result is "unchanged" and carries that document's "doc_id".
+    The check runs once the text is complete, so batches written before then
+    are deleted again.
+    """
+    doc_id = _doc_id(metadata)
+    with _document_lock(doc_id):
+        return _ingest_stream(VectorStore(), doc_id, pieces, metadata, chunks_per_batch, dedup)
+
+
+def _ingest_stream(store: VectorStore, doc_id: Optional[str], pieces: Iterable[str], metadata: dict,
+                   chunks_per_batch: Optional[int], dedup: bool) -> dict:
+    previous = store.document_chunks(doc_id) if doc_id is not None else {}
+    digest = _document_digest(metadata)
+    text_digest = _text_digest(metadata)
+
+    def hashed(pieces):
+        for piece in pieces:
+            data = piece.encode("utf-8")
+            digest.update(data)
+            text_digest.update(data)
+            yield piece
+
+    counts = {"total": 0, "unchanged": 0}
+    inserted = 0
+    deleted = []
+
+    def write(batch):
+        nonlocal inserted
+        written, replaced = _write_rows(store, batch)
+        inserted += written
+        counts["unchanged"] += len(batch) - written
+        deleted.extend(replaced)
+
+    batch = []
+    # converters time their own work, so "ingest.chunk" is chunking only
+    for row in _diff_chunks(timed_iter("ingest.chunk", stream_chunks(hashed(pieces))), metadata, previous, counts):
+        batch.append(row)
+        if chunks_per_batch and len(batch) >= chunks_per_batch:
+            write(batch)
+            batch = []
+
+    if dedup and doc_id is not None and counts["total"]:
+        stored = store.document_with_text(text_digest.hexdigest())
+        if stored is not None and stored["doc_id"] != doc_id:
+            _invalidate(store.delete_document(doc_id) or [])
+            return {
+                "inserted_chunks": 0,
+                "unchanged_chunks": stored["chunk_count"],
+                "deleted_chunks": 0,
+                "status": "unchanged",
+                "doc_id": stored["doc_id"]
+            }
+    write(batch)
+
+    # an empty conversion leaves the stored version alone
+    if doc_id is not None and counts["total"]:
+        deleted.extend(store.finish_documents(
+            [(doc_id, digest.hexdigest(), text_digest.hexdigest(), counts["total"])]
+        ))
+    _invalidate(deleted)
+
+    return {
+        "inserted_chunks": inserted,
+        "unchanged_chunks": counts["unchanged"],
+        "deleted_chunks": len(deleted),
+        "status": "ok" if inserted or deleted or not counts["unchanged"] else "unchanged"
+    }
+
+
+def ingest_documents(documents: Iterable[Tuple[str, dict]], docs_per_transaction: int = 200,
+                     db_path: str = DB_PATH) -> dict:
+    """Bulk ingest for backfills: (text, metadata) pairs, many documents per transaction.
+
+    Versioned documents (with a "doc_id") are skipped or partially replaced as in ingest_document.
+    """
+    store = VectorStore(db_path)
+    inserted_docs = inserted_chunks = unchanged_docs = 0
+    rows, finished, deleted = [], [], []
+
+    def flush():
+        nonlocal inserted_chunks
+        written, replaced = _write_rows(store, rows)
+        inserted_chunks += written
+        deleted.extend(replaced)
+        if finished:
+            deleted.extend(store.finish_documents(finished))
+        rows.clear()
+        finished.clear()
+
+    for text, metadata in documents:
+        doc_id = _doc_id(metadata)
+        previous = {}
+        if doc_id is not None:
+            doc_hash = content_hash(text, metadata)
+            stored = store.document(doc_id)
+            if stored is not None and stored["content_hash"] == doc_hash:
+                unchanged_docs += 1
+                continue
+            previous = store.document_chunks(doc_id)
+        counts = {"total": 0, "unchanged": 0}
+        with timed("ingest.chunk"):
+            chunks = list(stream_chunks([text]))
+        rows.extend(_diff_chunks(chunks, metadata, previous, counts))
+        if doc_id is not None and counts["total"]:
+            finished.append((doc_id, doc_hash, text_hash(text, metadata), counts["total"]))
+        inserted_docs += 1
+        if inserted_docs % docs_per_transaction == 0:
+            flush()
+    flush()
+    _invalidate(deleted, db_path)
 
     return {
-        "inserted_chunks": inserted_count,
+        "inserted_documents": inserted_docs,
+        "unchanged_documents": unchanged_docs,
+        "inserted_chunks": inserted_chunks,
+        "deleted_chunks": len(deleted),
         "status": "ok"
     }
+
+
+def delete_document(doc_id: str) -> Optional[int]:
+    """Remove a versioned document; returns the number of chunks deleted, or None if it is unknown."""
+    deleted = VectorStore().delete_document(doc_id)
+    if deleted is None:
+        return None
+    _invalidate(deleted)
+    return len(deleted)
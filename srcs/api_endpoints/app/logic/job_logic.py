@@ -0,0 +1,230 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from typing import BinaryIO, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from srcs.helpers.to_txt_conversion import iter_text
+from .ingest_logic import ingest_stream
+from .metrics import metrics, timed_iter
+from ..db.job_store import JobStore
+
+# uploads wait here until their job has run; kept on disk so queued jobs survive restarts
+UPLOAD_DIR = os.getenv("INGEST_UPLOAD_DIR", "ingest_uploads")
+# requests up to this size are received in memory; larger uploads are written straight into UPLOAD_DIR
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+# uploads still being received are named like this; ones a crash left behind are swept after an hour
+PARTIAL_PREFIX = ".partial-"
+ORPHAN_AGE_SECONDS = 3600
+# threads handle I/O-bound work (MP3 transcription polling, DB writes)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 4))
+# CPU-bound parsing (DOCX, pages of large PDFs) runs in separate processes
+PARSE_PROCESSES = int(os.getenv("INGEST_PARSE_PROCESSES", os.cpu_count() or 2))
+# a running job belongs to the process that claimed it while that process keeps renewing
+# the lease; a job whose lease ran out (its process died) is picked up by another one
+JOB_LEASE_SECONDS = float(os.getenv("INGEST_JOB_LEASE_SECONDS", 60))
+# progress is written at most this often per job
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+
+def upload_spool(total_content_length) -> BinaryIO:
+    """Buffer for an upload being received (see Flask's Request._get_file_stream).
+
+    Large uploads go to a temporary file next to the queued ones, so
+    save_upload() can link it into place rather than copy it; closing the
+    request deletes the temporary name.
+    """
+    if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_BYTES:
+        return BytesIO()
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return tempfile.NamedTemporaryFile(mode="w+b", dir=UPLOAD_DIR, prefix=PARTIAL_PREFIX)
+
+
+def save_upload(stream: BinaryIO, file_path: str):
+    """Store a received upload at `file_path`: a hard link when it was spooled to UPLOAD_DIR, else one copy."""
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.dirname(os.path.abspath(name)) == os.path.abspath(UPLOAD_DIR):
+        stream.flush()
+        try:
+            os.link(name, file_path)
+            return
+        except OSError:
+            pass  # no hard links on this filesystem
+    stream.seek(0)
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(stream, f)
+
+
+def _timed_conversion(file_path: str, pieces: Iterable[str]) -> Iterator[str]:
+    """Book converter time to "convert.<ext>" and count the characters it produces."""
+    ext = file_path.lower().split(".")[-1]
+    for piece in timed_iter(f"convert.{ext}", pieces):
+        metrics.inc("rag_converted_chars_total", len(piece))
+        yield piece
+
+
+class JobQueue:
+    def __init__(self, store: JobStore = None):
+        self.store = store or JobStore()
+        self._threads = None
+        self._processes = None
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._submitted = set()  # job ids handed to this process's threads and not finished yet
+        self._running = set()  # job ids this process has claimed
+        self._heartbeat = None
+
+    def _pools(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+                self._processes = ProcessPoolExecutor(max_workers=PARSE_PROCESSES)
+        return self._threads, self._processes
+
+    def start(self):
+        """Create the job table, pick up jobs no live process holds and start renewing leases.
+
+        Every worker process does this; a job only runs in the one that claims it.
+        """
+        self.store.initialize()
+        self._sweep({os.path.abspath(job["file_path"]) for job in self.store.unfinished()})
+        self._recover()
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._beat, name="ingest-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _recover(self):
+        for job in self.store.claimable():
+            self._submit(job["job_id"], job["file_path"], job["metadata"])
+
+    def _beat(self):
+        while True:
+            time.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                self.store.renew(running, self.owner, JOB_LEASE_SECONDS)
+                # jobs queued by other processes, or left by one that died
+                self._recover()
+            except Exception:
+                pass  # try again on the next beat
+
+    @staticmethod
+    def _sweep(keep: set):
+        """Delete uploads no job refers to, left behind by a crash.
+
+        Only files untouched for ORPHAN_AGE_SECONDS go: another worker may
+        be receiving or enqueueing a newer one right now.
+        """
+        if not os.path.isdir(UPLOAD_DIR):
+            return
+        cutoff = time.time() - ORPHAN_AGE_SECONDS
+        for entry in os.scandir(UPLOAD_DIR):
+            try:
+                if (entry.is_file() and os.path.abspath(entry.path) not in keep
+                        and entry.stat().st_mtime < cutoff):
+                    os.remove(entry.path)
+            except OSError:
+                pass  # already gone
+
+    def enqueue(self, file_name: str, save: Callable[[str], None], metadata: dict = None) -> str:
+        """Store an upload via `save(path)` under UPLOAD_DIR, record the job and hand it to a worker.
+
+        The document is versioned under metadata["doc_id"] when the caller gives one.
+        Otherwise the upload is a document of its own, with the job id as its doc_id:
+        equal file names say nothing about whether two uploads are the same document.
+        Equal content does, so such an upload whose text and metadata are already
+        stored finishes "unchanged", with the stored document's doc_id in its result.
+        """
+        job_id = uuid.uuid4().hex
+        metadata = dict(metadata or {})
+        metadata.setdefault("doc_id", job_id)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        file_path = os.path.join(UPLOAD_DIR, f"{job_id}_{file_name}")
+        try:
+            save(file_path)
+            self.store.create(file_path, file_name, metadata, job_id=job_id)
+        except BaseException:
+            # no job will ever remove it
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
+        self._submit(job_id, file_path, metadata)
+        return job_id
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    def _submit(self, job_id: str, file_path: str, metadata: dict):
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        threads, _ = self._pools()
+        threads.submit(self._run, job_id, file_path, metadata)
+
+    def _run(self, job_id: str, file_path: str, metadata: dict):
+        try:
+            if not self.store.claim(job_id, self.owner, JOB_LEASE_SECONDS):
+                return  # another process got it first
+            with self._lock:
+                self._running.add(job_id)
+            self._ingest(job_id, file_path, metadata)
+        finally:
+            with self._lock:
+                self._submitted.discard(job_id)
+                self._running.discard(job_id)
+
+    def _ingest(self, job_id: str, file_path: str, metadata: dict):
+        finished = False
+        try:
+            self.store.update(job_id, progress=0.1, owner=self.owner)
+            _, processes = self._pools()
+            # conversion and chunking are interleaved; text is never held in full
+            pieces = _timed_conversion(file_path, iter_text(file_path, executor=processes,
+                                                            progress=self._progress(job_id),
+                                                            max_in_flight=2 * PARSE_PROCESSES))
+            # enqueue() names a document after its job only when the upload gave no doc_id; such
+            # an upload is skipped if the same content is already stored under another doc_id
+            result = ingest_stream(pieces, metadata=metadata, dedup=(metadata or {}).get("doc_id") == job_id)
+            if not result["inserted_chunks"] and not result["unchanged_chunks"]:
+                finished = self.store.update(job_id, status="failed", stage="converting", error="Missing text",
+                                             owner=self.owner)
+                return
+
+            finished = self.store.update(job_id, status="done", stage="done", progress=1.0, result=result,
+                                         owner=self.owner)
+        except Exception as e:
+            finished = self.store.update(job_id, status="failed", error=str(e), owner=self.owner)
+        finally:
+            # the job reached a final state; the upload is no longer needed. If the lease was
+            # lost meanwhile, the process that took the job over still needs the file.
+            if finished and os.path.exists(file_path):
+                os.remove(file_path)
+
+    def _progress(self, job_id: str) -> Callable[[float], None]:
+        """Converter progress (0..1 of the input) as job progress between 0.1 and 0.9, written at most once a second."""
+        last = {"at": 0.0}
+
+        def report(fraction: float):
+            now = time.monotonic()
+            if now - last["at"] >= PROGRESS_INTERVAL_SECONDS:
+                last["at"] = now
+                self.store.update(job_id, progress=round(0.1 + 0.8 * min(max(fraction, 0.0), 1.0), 3),
+                                  owner=self.owner)
+        return report
+
+
+_queue = None
+
+def get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -0,0 +1,148 @@
+"""Process-level stage timers and counters, rendered in the Prometheus text format.
+
+Stages are timed with `timed(stage)` (or `timed_iter` for the time spent
+producing the items of an iterator). Timings are exclusive: time spent
+in a stage nested inside another on the same thread is booked to the
+inner stage only, so the stages of a request add up to its total.
+Within `collect_timings()` the stages and counters of the current request
+are also gathered into a dict that routes can return to the caller.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER_HELP = {
+    "rag_chunks_scanned_total": "Candidate chunks scored by retrieval",
+    "rag_retrieval_queries_total": "retrieve() calls that reached the index",
+    "rag_llm_calls_total": "Upstream LLM requests",
+    "rag_llm_prompt_tokens_total": "Prompt tokens sent upstream",
+    "rag_llm_completion_tokens_total": "Completion tokens received",
+    "rag_ingest_chunks_total": "Chunks written to the store",
+    "rag_converted_chars_total": "Characters of text produced by the converters",
+    "rag_retrieval_cache_hits_total": "retrieve() calls answered from the result cache",
+    "rag_retrieval_cache_misses_total": "retrieve() calls not in the result cache",
+    "rag_llm_cache_hits_total": "Completions served from the response cache",
+    "rag_llm_cache_misses_total": "Response cache lookups that missed",
+    "rag_llm_calls_shared_total": "Completions that joined an identical call in flight",
+}
+
+_request: ContextVar[Optional[dict]] = ContextVar("request_timings", default=None)
+_local = threading.local()
+
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.stages: Dict[str, list] = {}  # stage -> [count per bucket..., +Inf count, sum]
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        current = _request.get()
+        if current is not None:
+            current["counters"][name] = current["counters"].get(name, 0) + value
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+                    break
+            else:
+                hist[len(self.buckets)] += 1
+            hist[-1] += seconds
+        current = _request.get()
+        if current is not None:
+            current["stages"][stage] = current["stages"].get(stage, 0.0) + seconds * 1000
+
+    def render(self, counters: Dict[str, float] = None, gauges: Dict[str, float] = None) -> str:
+        """Prometheus exposition text, plus counters and gauges kept elsewhere (e.g. cache stats)."""
+        with self.lock:
+            counters = dict(self.counters, **(counters or {}))
+            stages = {stage: list(hist) for stage, hist in self.stages.items()}
+        lines = []
+        for name in sorted(counters):
+            lines.append(f"# HELP {name} {COUNTER_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {counters[name]:g}")
+        if stages:
+            lines.append("# HELP rag_stage_seconds Time spent per stage, excluding nested stages")
+            lines.append("# TYPE rag_stage_seconds histogram")
+        for stage in sorted(stages):
+            hist = stages[stage]
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), hist):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+            lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+        for name in sorted(gauges or {}):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {gauges[name]:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block on this thread. Not for blocks that await: use metrics.observe there."""
+    stack = _stack()
+    nested = [0.0]  # time taken by stages inside this one
+    stack.append(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        metrics.observe(stage, elapsed - nested[0])
+
+
+def timed_iter(stage: str, items: Iterable) -> Iterator:
+    """Yield from `items`, booking the time spent producing each item to `stage`."""
+    it = iter(items)
+    while True:
+        with timed(stage):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+@contextmanager
+def collect_timings(enabled: bool = True):
+    """Gather this request's stages (milliseconds) and counters; yields the dict, or None when disabled."""
+    if not enabled:
+        yield None
+        return
+    current = {"stages": {}, "counters": {}}
+    token = _request.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current["total_ms"] = (time.perf_counter() - start) * 1000
+        _request.reset(token)
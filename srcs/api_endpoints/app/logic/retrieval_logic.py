@@ -1,7 +1,11 @@
 import math
-from collections import Counter
-from typing import Dict, List, Tuple
-from ..db.vector_store import VectorStore
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Set, Tuple
+from ..db.vector_store import VectorStore, TokenVector, meta_value
+from .metrics import metrics, timed
+from .sharding import SHARD_COUNT, SHARDED_RANKINGS, get_router
 
 TOKEN_RE = __import__("re").compile(r"\w+")
 
@@ -11,9 +15,9 @@ def tokens(text: str):
 def token_counts(text: str) -> Dict[str,int]:
     return dict(Counter(tokens(text)))
 
-def dot_product(a: Dict[str,int], b: Dict[str,int]) -> float:
+def dot_product(a, b) -> float:
     s = 0.0
-    # iterate smaller dict
+    # iterate smaller vector; works for token dicts and packed TokenVectors alike
     if len(a) < len(b):
         for k,v in a.items():
             s += v * b.get(k, 0)
@@ -22,10 +26,12 @@ def dot_product(a: Dict[str,int], b: Dict[str,int]) -> float:
             s += v * a.get(k, 0)
     return s
 
-def magnitude(a: Dict[str,int]) -> float:
+def magnitude(a) -> float:
+    if isinstance(a, TokenVector):
+        return a.norm
     return math.sqrt(sum(v*v for v in a.values()))
 
-def cosine_sim(a: Dict[str,int], b: Dict[str,int]) -> float:
+def cosine_sim(a, b) -> float:
     mag_a = magnitude(a)
     mag_b = magnitude(b)
     if mag_a == 0 or mag_b == 0:
@@ -33,43 +39,218 @@ def cosine_sim(a: Dict[str,int], b: Dict[str,int]) -> float:
     return dot_product(a,b) / (mag_a * mag_b)
 
 
-import json
+import heapq
 
-def retrieve(query: str, regions: list, top_k: int = 3) -> list:
+# BM25 parameters (Robertson/Lucene defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def bm25_idf(doc_freq: int, n_docs: int) -> float:
+    return math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _python_top_k(cache, q_tokens: Dict[str,int], q_mag: float, top_k: int, allowed: Set[int] = None,
+                  ranking: str = "cosine", stats: tuple = None) -> List[Tuple[float,int]]:
+    # Only chunks sharing at least one query term can score above zero,
+    # so accumulate scores straight from the inverted index.
+    scores: Dict[int, float] = {}
+    n_docs, avg_len = len(cache.vectors), cache.avg_length
+    doc_freqs = None
+    if stats is not None:
+        # collection statistics of the whole corpus when `cache` holds a single shard
+        n_docs, avg_len, doc_freqs = stats
+    for term, count in q_tokens.items():
+        # a shard's vocabulary also holds terms that only occur in other shards
+        entry = cache.postings.get(cache.vocab.get(term))
+        if entry is None:
+            continue
+        chunk_ids, tfs = entry
+        postings = zip(chunk_ids, tfs)
+        if allowed is not None:
+            postings = ((cid, tf) for cid, tf in postings if cid in allowed)
+        if ranking == "bm25":
+            weight = count * bm25_idf(doc_freqs[term] if doc_freqs is not None else len(chunk_ids), n_docs)
+            for chunk_id, tf in postings:
+                denom = tf + BM25_K1 * (1 - BM25_B + BM25_B * cache.lengths[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight * tf * (BM25_K1 + 1) / denom
+        else:
+            for chunk_id, tf in postings:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + count * tf
+
+    metrics.inc("rag_chunks_scanned_total", len(scores))
+    if ranking == "bm25":
+        scored = ((s, cid) for cid, s in scores.items())
+    else:
+        scored = ((d / (q_mag * cache.vectors[cid].norm), cid) for cid, d in scores.items() if cache.vectors[cid].norm > 0)
+    # Bounded top-k; ties go to the older chunk, as with the old full scan
+    return heapq.nlargest(top_k, scored, key=lambda x: (x[0], -x[1]))
+
+
+def _numpy_top_k(cache, q_tokens: Dict[str,int], q_mag: float, top_k: int, allowed: Set[int] = None,
+                 ranking: str = "cosine") -> List[Tuple[float,int]]:
+    from .sparse_scoring import corpus_matrix
+    query = {cache.vocab[t]: c for t, c in q_tokens.items() if t in cache.vocab}
+    return corpus_matrix(cache).top_k(query, q_mag, top_k, allowed, ranking)
+
+
+# Reciprocal rank fusion constant for hybrid ranking
+RRF_K = 60
+
+def _dense_searcher(cache, query: str):
+    """Sync the ANN index with the cache generation and embed the query (outside cache.lock).
+
+    Also says whether the index covers every chunk, i.e. whether the results may be cached.
+    """
+    from ..db.dense_index import get_dense_index
+    from .embedding_logic import get_embedder
+    embedder = get_embedder()
+    index = get_dense_index(cache.db_path, embedder).sync(cache.generation)
+    q_vec = embedder.embed([query])[0]
+
+    def search(top_k: int, allowed: Set[int] = None) -> List[Tuple[float,int]]:
+        # the index may already hold rows the cache snapshot has not loaded yet
+        return [(s, cid) for s, cid in index.search(q_vec, top_k, allowed) if cid in cache.vectors]
+    return search, index.complete
+
+
+def _fuse(rankings: List[List[Tuple[float,int]]], top_k: int) -> List[Tuple[float,int]]:
+    fused: Dict[int, float] = {}
+    for ranked in rankings:
+        for rank, (_, cid) in enumerate(ranked):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return heapq.nlargest(top_k, ((s, cid) for cid, s in fused.items()), key=lambda x: (x[0], -x[1]))
+
+
+BACKENDS = {
+    "python": _python_top_k,
+    "numpy": _numpy_top_k,
+}
+DEFAULT_BACKEND = os.getenv("RETRIEVAL_BACKEND", "python")
+# load the index when the app is created rather than on the first query (0 disables)
+RETRIEVAL_WARM_UP = int(os.getenv("RETRIEVAL_WARM_UP", 1))
+# dense and hybrid need numpy for the ANN index; hybrid fuses BM25 with dense ranks
+RANKINGS = ("cosine", "bm25", "dense", "hybrid")
+
+
+# LRU of finished retrievals, shared by /api/query and /api/generate-data
+RESULT_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024))
+_results: "OrderedDict[tuple, list]" = OrderedDict()
+_results_lock = threading.Lock()
+result_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _result_key(query: str, q_tokens: Dict[str,int], filters: Dict, top_k: int, backend: str,
+                ranking: str, cache) -> tuple:
+    # lexical scores only depend on the token counts; embedders may also care about word order
+    text_key = tuple(tokens(query)) if ranking in ("dense", "hybrid") else tuple(sorted(q_tokens.items()))
+    filter_key = tuple(sorted(
+        (key, tuple(sorted(meta_value(v) for v in (values if isinstance(values, list) else [values]))))
+        for key, values in filters.items()
+    ))
+    # the generation moves on every insert/clear, so stale entries simply stop matching
+    return (cache.db_path, cache.generation, text_key, filter_key, top_k, backend, ranking)
+
+
+def _copy_results(results: list) -> list:
+    return [{"id": r["id"], "chunk": r["chunk"], "metadata": dict(r["metadata"])} for r in results]
+
+
+def retrieve(query: str, regions: list, top_k: int = 3, backend: str = None, ranking: str = "cosine",
+             filters: Dict[str, list] = None) -> list:
+    """Top-k chunks for `query`.
+
+    `regions` and `filters` ({metadata key: value or list of values}) are
+    matched case-insensitively against the metadata index before scoring;
+    values of one key are OR-ed, different keys are AND-ed.
+    """
+    backend = backend or DEFAULT_BACKEND
+    score_top_k = BACKENDS[backend]
+    if ranking not in RANKINGS:
+        raise ValueError(f"Unknown ranking {ranking!r}, expected one of {RANKINGS}")
     q_tokens = token_counts(query)
-    store = VectorStore()
-    rows = store.all_chunks()
-    scored = []
+    q_mag = magnitude(q_tokens)
+    if q_mag == 0:
+        return []
+    sharded = SHARD_COUNT > 0 and ranking in SHARDED_RANKINGS
+    with timed("retrieval.refresh"):
+        if sharded:
+            # shards always score with the python backend in their own processes
+            cache = get_router(VectorStore().db_path, SHARD_COUNT)
+        else:
+            cache = VectorStore().cache()
+
+    # Filter by regions (and any other metadata) if specified
+    filters = dict(filters or {})
+    if regions:
+        filters["regions"] = regions
 
-    for r in rows:
-        metadata = r.get("metadata", {})
+    key = _result_key(query, q_tokens, filters, top_k, backend, ranking, cache)
+    with _results_lock:
+        cached = _results.get(key)
+        if cached is not None:
+            _results.move_to_end(key)
+            result_cache_stats["hits"] += 1
+            return _copy_results(cached)
+        result_cache_stats["misses"] += 1
 
-        # Parse metadata if it's a JSON string
-        if isinstance(metadata, str):
-            try:
-                metadata = json.loads(metadata)
-            except json.JSONDecodeError:
-                metadata = {}
+    metrics.inc("rag_retrieval_queries_total")
+    if sharded:
+        results, complete = _retrieve_sharded(cache, q_tokens, q_mag, top_k, ranking, filters), True
+    else:
+        results, complete = _retrieve(cache, query, q_tokens, q_mag, top_k, score_top_k, ranking, filters)
+    if complete:
+        with _results_lock:
+            _results[key] = results
+            while len(_results) > RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+    return _copy_results(results)
 
-        chunk_regions = metadata.get("regions", [])
 
-        # Filter by regions if any are specified
-        if regions:
-            # Make comparison case-insensitive
-            if not any(reg.lower() in [c.lower() for c in chunk_regions] for reg in regions):
-                continue  # skip this chunk if no region matches
+def warm_up(backend: str = None) -> int:
+    """Load the retrieval index the default rankings use; returns the number of chunks loaded."""
+    backend = backend or DEFAULT_BACKEND
+    with timed("retrieval.warm_up"):
+        if SHARD_COUNT > 0:
+            return get_router(VectorStore().db_path, SHARD_COUNT).warm_up()
+        cache = VectorStore().cache()
+        with cache.lock:
+            if backend == "numpy":
+                from .sparse_scoring import corpus_matrix
+                corpus_matrix(cache)
+            return len(cache.vectors)
 
-        # Compute similarity
-        score = cosine_sim(q_tokens, r["tokens"])
-        scored.append((score, r, metadata))  # keep metadata for correct return
 
-    # Sort by score descending
-    scored.sort(key=lambda x: x[0], reverse=True)
+def _retrieve(cache, query: str, q_tokens: Dict[str,int], q_mag: float, top_k: int, score_top_k,
+              ranking: str, filters: Dict) -> Tuple[list, bool]:
+    """Results, and whether they are final (not from a dense index still being backfilled)."""
+    dense, complete = None, True
+    if ranking in ("dense", "hybrid"):
+        with timed("retrieval.embed"):
+            dense, complete = _dense_searcher(cache, query)
 
-    # Take top_k with positive score
-    top = [(s, r, m) for s, r, m in scored[:top_k] if s > 0]
+    with cache.lock:
+        with timed("retrieval.filter"):
+            allowed = cache.matching(filters) if filters else None
+        with timed("retrieval.score"):
+            if ranking == "dense":
+                top = dense(top_k, allowed)
+            elif ranking == "hybrid":
+                depth = max(4 * top_k, 20)
+                top = _fuse([score_top_k(cache, q_tokens, q_mag, depth, allowed, "bm25"), dense(depth, allowed)],
+                            top_k)
+            else:
+                top = score_top_k(cache, q_tokens, q_mag, top_k, allowed, ranking)
+        metadata = {cid: dict(cache.metadata[cid]) for _, cid in top}
 
-    # Return properly
-    return [{"id": r["id"], "chunk": r["chunk"], "metadata": m} for s, r, m in top]
+    with timed("retrieval.fetch"):
+        texts = cache.texts([cid for _, cid in top])
+    return [{"id": cid, "chunk": texts[cid], "metadata": metadata[cid]} for _, cid in top], complete
 
 
+def _retrieve_sharded(router, q_tokens: Dict[str,int], q_mag: float, top_k: int, ranking: str,
+                      filters: Dict) -> list:
+    with timed("retrieval.score"):
+        top = router.top_k(q_tokens, q_mag, top_k, filters, ranking)
+    with timed("retrieval.fetch"):
+        rows = VectorStore(router.db_path).chunks_by_ids([cid for _, cid in top])
+    return [rows[cid] for _, cid in top if cid in rows]
@@ -0,0 +1,174 @@
+"""Partitioned lexical retrieval across worker processes.
+
+With RETRIEVAL_SHARDS=N the corpus is split into N shards by shard_of():
+chunks go by their RETRIEVAL_SHARD_KEY metadata value (regions by
+default), or by id when they have none. Each shard is a ChunkCache that
+loads only its own chunks, living in its own single-worker process, so
+the shard's index stays resident in one place and shards score in
+parallel. The router in the API process keeps a small map from shard-key
+value to shards, so queries filtered on that key only touch the shards
+that can match. Per-shard top-k lists are merged into the global top-k;
+BM25 first collects corpus-wide statistics from every shard, so scores
+equal the unsharded ones.
+
+Used for the cosine and bm25 rankings; dense and hybrid stay on the
+in-process index.
+"""
+import heapq
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..db.connection import get_manager
+from ..db.vector_store import ChunkCache, meta_value, shard_of
+
+SHARD_COUNT = int(os.getenv("RETRIEVAL_SHARDS", 0))
+SHARD_KEY = os.getenv("RETRIEVAL_SHARD_KEY", "regions")
+SHARDED_RANKINGS = ("cosine", "bm25")
+
+
+# ---------- shard worker process ----------
+
+_shard_cache: Optional[ChunkCache] = None
+_shard_generation = None
+
+
+def _init_shard(db_path: str, index: int, n_shards: int, key: str):
+    global _shard_cache
+    _shard_cache = ChunkCache(db_path, shard=(index, n_shards, key))
+
+
+def _fresh_shard(generation) -> ChunkCache:
+    global _shard_generation
+    if generation != _shard_generation:
+        # the router saw a commit; don't wait for the periodic recheck
+        _shard_cache.mark_stale()
+        _shard_generation = generation
+    return _shard_cache.ensure_fresh()
+
+
+def _shard_stats(terms: List[str], generation) -> Tuple[int, int, Dict[str, int]]:
+    cache = _fresh_shard(generation)
+    with cache.lock:
+        doc_freqs = {t: cache.doc_freq(cache.vocab[t]) if t in cache.vocab else 0 for t in terms}
+        return len(cache.vectors), cache.total_length, doc_freqs
+
+
+def _shard_top_k(q_tokens: Dict[str, int], q_mag: float, top_k: int, filters: Dict, ranking: str,
+                 stats: Optional[tuple], generation) -> List[Tuple[float, int]]:
+    from .retrieval_logic import _python_top_k
+    cache = _fresh_shard(generation)
+    with cache.lock:
+        allowed = cache.matching(filters) if filters else None
+        if allowed is not None and not allowed:
+            return []
+        return _python_top_k(cache, q_tokens, q_mag, top_k, allowed, ranking, stats)
+
+
+# ---------- router (API process) ----------
+
+class ShardRouter:
+    def __init__(self, db_path: str, n_shards: int = SHARD_COUNT, key: str = SHARD_KEY):
+        self.db_path = db_path
+        self.n_shards = n_shards
+        self.key = key
+        self.lock = threading.Lock()
+        self.generation = 0
+        self._conn = None
+        self._data_version = None
+        self._chunks = None  # (max chunk id, chunk count) when the generation last moved
+        self._routes: Dict[str, Set[int]] = {}  # normalized key value -> shards holding it
+        self._max_id = 0
+        self._pools = [
+            ProcessPoolExecutor(max_workers=1, initializer=_init_shard, initargs=(db_path, i, n_shards, key))
+            for i in range(n_shards)
+        ]
+
+    def ensure_fresh(self) -> "ShardRouter":
+        with self.lock:
+            if self._conn is None:
+                # a dedicated connection: PRAGMA data_version only tracks commits made by other connections
+                self._conn = get_manager(self.db_path).connect(check_same_thread=False)
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._data_version = version
+                # any commit moves data_version (LLM cache, jobs, ...); only new or deleted chunks
+                # change what the shards return
+                chunks = self._conn.execute("SELECT COALESCE(MAX(chunk_id), 0), COUNT(*) FROM chunk_vectors").fetchone()
+                if chunks != self._chunks:
+                    self._load_routes()
+                    self._chunks = chunks
+                    self.generation += 1
+            return self
+
+    def _load_routes(self):
+        # routes only grow; a value whose chunks were deleted just costs a wasted shard call
+        cur = self._conn.execute(
+            "SELECT chunk_id, value FROM chunk_meta WHERE key = ? AND chunk_id > ? ORDER BY chunk_id",
+            (self.key, self._max_id)
+        )
+        values_by_chunk: Dict[int, List[str]] = {}
+        for chunk_id, value in cur:
+            values_by_chunk.setdefault(chunk_id, []).append(value)
+        for chunk_id, values in values_by_chunk.items():
+            shard = shard_of(chunk_id, {self.key: values}, self.n_shards, self.key)
+            for value in values:
+                self._routes.setdefault(value, set()).add(shard)
+            self._max_id = max(self._max_id, chunk_id)
+
+    def shards_for(self, filters: Dict) -> List[int]:
+        values = filters.get(self.key) if filters else None
+        if values is None:
+            return list(range(self.n_shards))
+        if not isinstance(values, list):
+            values = [values]
+        if not values:
+            return list(range(self.n_shards))
+        with self.lock:
+            shards = set()
+            for v in values:
+                shards |= self._routes.get(meta_value(v), set())
+        return sorted(shards)
+
+    def _stats(self, terms: List[str], generation) -> tuple:
+        futures = [pool.submit(_shard_stats, terms, generation) for pool in self._pools]
+        n_docs = total_length = 0
+        doc_freqs = dict.fromkeys(terms, 0)
+        for future in futures:
+            shard_docs, shard_length, shard_freqs = future.result()
+            n_docs += shard_docs
+            total_length += shard_length
+            for term, df in shard_freqs.items():
+                doc_freqs[term] += df
+        return n_docs, total_length / n_docs if n_docs else 0.0, doc_freqs
+
+    def warm_up(self) -> int:
+        """Have every shard load its index now instead of on its first query; returns the chunk count."""
+        return self._stats([], self.generation)[0]
+
+    def top_k(self, q_tokens: Dict[str, int], q_mag: float, top_k: int, filters: Dict,
+              ranking: str = "cosine") -> List[Tuple[float, int]]:
+        shards = self.shards_for(filters)
+        if not shards or top_k <= 0:
+            return []
+        generation = self.generation
+        stats = self._stats(list(q_tokens), generation) if ranking == "bm25" else None
+        futures = [self._pools[s].submit(_shard_top_k, q_tokens, q_mag, top_k, filters, ranking, stats, generation)
+                   for s in shards]
+        merged = (hit for future in futures for hit in future.result())
+        # same ordering as a single index: score, then the older chunk
+        return heapq.nlargest(top_k, merged, key=lambda x: (x[0], -x[1]))
+
+
+_routers: Dict[tuple, ShardRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(db_path: str, n_shards: int = SHARD_COUNT) -> ShardRouter:
+    key = (os.path.abspath(db_path), n_shards)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = ShardRouter(db_path, n_shards)
+    return router.ensure_fresh()
@@ -0,0 +1,90 @@
+"""Vectorized cosine scoring over a CSR term-document matrix (NumPy/SciPy).
+
+Selected with `retrieve(..., backend="numpy")` or RETRIEVAL_BACKEND=numpy.
+Rows hold raw term counts and the chunk norms sit in a separate vector, so
+each cosine score is computed as dot / (q_mag * norm) exactly like the
+pure-Python path and rankings come out identical. BM25 uses a second matrix
+of saturated term weights, built on first use.
+"""
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from .metrics import metrics
+from ..db.vector_store import ChunkCache
+
+
+class CorpusMatrix:
+    def __init__(self, cache: ChunkCache):
+        chunk_ids = sorted(cache.vectors)
+        vectors = [cache.vectors[cid] for cid in chunk_ids]
+        indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in vectors], out=indptr[1:])
+        indices = np.concatenate([np.frombuffer(v.term_ids, dtype=np.uint32) for v in vectors]) if vectors else np.zeros(0, np.uint32)
+        data = np.concatenate([np.frombuffer(v.tfs, dtype=np.uint32) for v in vectors]) if vectors else np.zeros(0, np.uint32)
+        n_terms = max(cache.vocab.values(), default=0) + 1
+
+        self.generation = cache.generation
+        self.chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        self.norms = np.asarray([v.norm for v in vectors], dtype=np.float64)
+        self.lengths = np.asarray([cache.lengths[cid] for cid in chunk_ids], dtype=np.float64)
+        self.matrix = sparse.csr_matrix(
+            (data.astype(np.float64), indices.astype(np.int32), indptr),
+            shape=(len(vectors), n_terms),
+        )
+        self._bm25 = None
+
+    def _bm25_matrix(self):
+        if self._bm25 is None:
+            from .retrieval_logic import BM25_K1, BM25_B, bm25_idf
+            n_docs = self.matrix.shape[0]
+            avg_len = self.lengths.mean() if n_docs else 0.0
+            tf = self.matrix.data
+            row_len = np.repeat(self.lengths, np.diff(self.matrix.indptr))
+            weights = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * row_len / avg_len))
+            doc_freq = np.bincount(self.matrix.indices, minlength=self.matrix.shape[1])
+            idf = np.array([bm25_idf(int(df), n_docs) for df in doc_freq])
+            self._bm25 = (sparse.csr_matrix((weights, self.matrix.indices, self.matrix.indptr), shape=self.matrix.shape), idf)
+        return self._bm25
+
+    def top_k(self, query: Dict[int, int], q_mag: float, top_k: int,
+              allowed: Optional[Set[int]] = None, ranking: str = "cosine") -> List[Tuple[float, int]]:
+        if top_k <= 0 or not query:
+            return []
+        q = np.zeros(self.matrix.shape[1], dtype=np.float64)
+        q[list(query)] = list(query.values())
+        if ranking == "bm25":
+            matrix, idf = self._bm25_matrix()
+            dots = matrix @ (q * idf)
+        else:
+            dots = self.matrix @ q
+
+        cand = np.flatnonzero(dots > 0)
+        if allowed is not None:
+            cand = cand[np.isin(self.chunk_ids[cand], np.fromiter(allowed, dtype=np.int64, count=len(allowed)))]
+        scores = dots[cand] if ranking == "bm25" else dots[cand] / (q_mag * self.norms[cand])
+        metrics.inc("rag_chunks_scanned_total", len(cand))
+
+        if len(cand) > top_k:
+            # everything tied with the k-th best survives so ties resolve by id below
+            kth = scores[np.argpartition(scores, -top_k)[-top_k:]].min()
+            mask = scores >= kth
+            cand, scores = cand[mask], scores[mask]
+        ids = self.chunk_ids[cand]
+        order = np.lexsort((ids, -scores))[:top_k]
+        return [(float(scores[i]), int(ids[i])) for i in order]
+
+
+_matrices: Dict[str, CorpusMatrix] = {}
+_lock = threading.Lock()
+
+
+def corpus_matrix(cache: ChunkCache) -> CorpusMatrix:
+    """CSR view of `cache`, rebuilt only when the cache generation moves. Call with cache.lock held."""
+    with _lock:
+        matrix = _matrices.get(cache.db_path)
+        if matrix is None or matrix.generation != cache.generation:
+            matrix = _matrices[cache.db_path] = CorpusMatrix(cache)
+        return matrix
@@ -1,30 +1,44 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Request, request, jsonify
 import json
-from srcs.helpers.to_txt_conversion import convert_to_text
-from ..logic.ingest_logic import ingest_document
+import os
+from functools import partial
+from werkzeug.utils import secure_filename
+from srcs.helpers.to_txt_conversion import SUPPORTED_EXTENSIONS
+from ..logic.job_logic import get_queue, save_upload, upload_spool
+from ..logic.ingest_logic import delete_document
 from ..db.vector_store import VectorStore
-import tempfile
+from ..db.response_cache import get_response_cache
 
 ingest_bp = Blueprint("ingest", __name__)
 
 
+class UploadRequest(Request):
+    """Receives small uploads in memory and large ones directly into the job queue's upload directory."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_spool(total_content_length)
+
+
 @ingest_bp.route("/ingest", methods=["POST"])
 def ingest():
+    """
+    POST /api/ingest (multipart: file, metadata, optional doc_id)
+    Queues the file for conversion and indexing and returns at once.
+    Re-uploading a document with the same doc_id skips it if unchanged and
+    otherwise only replaces the chunks that differ. Without a doc_id (form
+    field or in metadata) an upload is a new document with doc_id = job_id,
+    unless its content is already stored: the job then finishes "unchanged"
+    with the stored document's doc_id in its result.
+    Response (202): {"status": "queued", "job_id": "...", "doc_id": "..."}
+    """
+    return _enqueue_upload(request.form.get("doc_id"))
+
+
+def _enqueue_upload(doc_id):
     uploaded_file = request.files.get("file")
     if not uploaded_file:
         return jsonify({"error": "Missing file upload"}), 400
 
-    # Temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{uploaded_file.filename}") as tmp:
-        uploaded_file.save(tmp.name)
-        tmp_path = tmp.name
-
-    # Convert file → text
-    text = convert_to_text(tmp_path)
-
-    if not text:
-        return jsonify({"error": "Missing text"}), 400
-
     # Parse metadata from form-data
     body = request.form or {}
     metadata_raw = body.get("metadata")
@@ -34,14 +48,73 @@ def ingest():
             metadata = json.loads(metadata_raw)
         except json.JSONDecodeError:
             return jsonify({"error": "Invalid JSON in metadata"}), 400
+        if not isinstance(metadata, dict):
+            return jsonify({"error": "'metadata' must be a JSON object"}), 400
+
+    if doc_id:
+        metadata = dict(metadata or {}, doc_id=doc_id)
+
+    # The converter goes by the extension; split it off first, since secure_filename
+    # drops non-ASCII characters and would turn "файл.pdf" into "pdf"
+    stem, ext = os.path.splitext(uploaded_file.filename or "")
+    ext = ext.lstrip(".").lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        return jsonify({"error": "Unsupported file type. Use PDF, DOCX, MD, MP3 or XLSX."}), 400
+
+    # Keep the upload until a worker has converted it
+    file_name = f"{secure_filename(stem) or 'upload'}.{ext}"
+    job_id = get_queue().enqueue(file_name, partial(save_upload, uploaded_file.stream), metadata)
+
+    doc_id = (metadata or {}).get("doc_id") or job_id
+    return jsonify({"status": "queued", "job_id": job_id, "doc_id": doc_id}), 202
+
+
+@ingest_bp.route("/ingest/<job_id>", methods=["GET"])
+def ingest_status(job_id):
+    """
+    GET /api/ingest/<job_id>
+    Response: {"job_id", "status": queued|running|done|failed, "stage", "progress", "result", "error", ...}
+    """
+    job = get_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    job.pop("file_path", None)
+    return jsonify(job)
+
+
+@ingest_bp.route("/documents", methods=["GET"])
+def list_documents():
+    """
+    GET /api/documents
+    Response: {"documents": [{"doc_id", "content_hash", "chunk_count", "updated_at"}, ...]}
+    """
+    return jsonify({"documents": VectorStore().documents()})
+
+
+@ingest_bp.route("/documents/<path:doc_id>", methods=["PUT"])
+def replace_document(doc_id):
+    """
+    PUT /api/documents/<doc_id> (multipart: file, metadata)
+    Queues a new version of the document; same response as POST /api/ingest.
+    """
+    return _enqueue_upload(doc_id)
+
 
-    # Use the text as before
-    result = ingest_document(text, metadata=metadata)
-    return jsonify({"status": "ok", **result}), 201
+@ingest_bp.route("/documents/<path:doc_id>", methods=["DELETE"])
+def remove_document(doc_id):
+    """
+    DELETE /api/documents/<doc_id>
+    Response: {"status": "deleted", "deleted_chunks": N}
+    """
+    deleted = delete_document(doc_id)
+    if deleted is None:
+        return jsonify({"error": "Unknown document"}), 404
+    return jsonify({"status": "deleted", "deleted_chunks": deleted})
 
 
 @ingest_bp.route("/ingest/clear", methods=["POST"])
 def clear():
     # helper to clear DB during dev
     VectorStore().clear()
+    get_response_cache().clear()
     return jsonify({"status": "cleared"})
@@ -1,29 +1,100 @@
-from flask import Blueprint, request, jsonify
-from ..logic.retrieval_logic import retrieve
-from ..logic.generation_logic import generate_answer, generate_structured_data
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from ..logic.retrieval_logic import retrieve, RANKINGS, result_cache_stats
+from ..logic.generation_logic import (
+    build_data_prompt, build_prompt, coalescing_stats, generate_answer, generate_structured_data, stream_answer,
+)
+from ..logic.context_logic import assemble_context, prompt_tokens
+from ..logic.metrics import collect_timings, metrics, timed
+from ..db.response_cache import get_response_cache
+from ..db.vector_store import DB_PATH, get_cache
 
 query_bp = Blueprint("query", __name__)
 
+NO_CONTEXT_ANSWER = "No relevant context found in the database."
+
+
+def parse_retrieval_body(body: dict):
+    """Validate the retrieval fields shared by /query and /generate-data.
+
+    Returns (retrieve() keyword arguments, None) or (None, error message).
+    """
+    ranking = body.get("ranking", "cosine")
+    if ranking not in RANKINGS:
+        return None, f"Unknown 'ranking', expected one of {list(RANKINGS)}"
+    filters = body.get("filters", None)
+    if filters is not None and not isinstance(filters, dict):
+        return None, "'filters' must be an object"
+    return {
+        "top_k": int(body.get("top_k", 3)),
+        "regions": body.get("regions", None),
+        "ranking": ranking,
+        "filters": filters,
+    }, None
+
+
+def pack_context(q: str, retrieved: list, build) -> (list, list, int):
+    """Merge and budget the retrieved chunks; returns (context_chunks, chunk_ids, prompt tokens for `build`)."""
+    with timed("context.pack"):
+        context_chunks, _ = assemble_context(retrieved)
+        chunk_ids = [r["id"] for r in retrieved]
+        tokens = prompt_tokens(*build(q, context_chunks)) if context_chunks else 0
+    return context_chunks, chunk_ids, tokens
+
+
+def sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def _stream_query(q: str, context_chunks: list, chunk_ids: list, tokens: int) -> Response:
+    """Server-sent events: `context` first, then `token` deltas, then `done` (or `error`)."""
+    def events():
+        yield sse("context", {"used_context": context_chunks, "prompt_tokens": tokens})
+        if not context_chunks:
+            yield sse("token", {"token": NO_CONTEXT_ANSWER})
+        else:
+            try:
+                for token in stream_answer(q, context_chunks, chunk_ids):
+                    yield sse("token", {"token": token})
+            except Exception as e:
+                yield sse("error", {"error": str(e)})
+                return
+        yield sse("done", {})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @query_bp.route("/query", methods=["POST"])
 def query():
     """
     POST /api/query
-    JSON body: {"query": "..." , "top_k": 3}
-    Response: {"answer": "...", "used_context": [...chunks...]}
+    JSON body: {"query": "..." , "top_k": 3, "ranking": "cosine" | "bm25" | "dense" | "hybrid",
+                "regions": [...], "filters": {"<metadata key>": [...values]}, "stream": false, "timings": false}
+    Response: {"answer": "...", "used_context": [...merged chunks...], "prompt_tokens": N}
+    With "stream": true the answer is sent as text/event-stream (see _stream_query).
+    With "timings": true the response also has "timings": {"total_ms", "stages": {stage: ms}, "counters"}.
     """
     body = request.get_json(force=True)
     q = body.get("query")
     if not q:
         return jsonify({"error": "Missing 'query' in body"}), 400
-    top_k = int(body.get("top_k", 3))
-    regions = body.get("regions", None)
-    retrieved = retrieve(q, regions = regions, top_k=top_k, )
-    context_chunks = [r["chunk"] for r in retrieved]
-    if not context_chunks:
-        # no context found, still call model but warn or return "no context"
-        return jsonify({"answer": "No relevant context found in the database.", "used_context": []})
-    answer = generate_answer(q, context_chunks)
-    return jsonify({"answer": answer, "used_context": context_chunks})
+    args, error = parse_retrieval_body(body)
+    if error:
+        return jsonify({"error": error}), 400
+    with collect_timings(bool(body.get("timings"))) as timings:
+        retrieved = retrieve(q, **args)
+        context_chunks, chunk_ids, tokens = pack_context(q, retrieved, build_prompt)
+        if body.get("stream"):
+            return _stream_query(q, context_chunks, chunk_ids, tokens)
+        if not context_chunks:
+            # no context found, still call model but warn or return "no context"
+            payload = {"answer": NO_CONTEXT_ANSWER, "used_context": [], "prompt_tokens": 0}
+        else:
+            answer = generate_answer(q, context_chunks, chunk_ids)
+            payload = {"answer": answer, "used_context": context_chunks, "prompt_tokens": tokens}
+    if timings is not None:
+        payload["timings"] = timings
+    return jsonify(payload)
 
 
 generate_data_bp = Blueprint("generate_data", __name__)
@@ -32,28 +103,72 @@ generate_data_bp = Blueprint("generate_data", __name__)
 def generate_data():
     """
     POST /api/generate-data
-    JSON body: {"query": "...", "top_k": 3}
-    Returns: {"data": [...], "used_context": [...]}
+    JSON body: {"query": "...", "top_k": 3, "ranking": "cosine" | "bm25" | "dense" | "hybrid",
+                "regions": [...], "filters": {"<metadata key>": [...values]}, "timings": false}
+    Returns: {"data": [...], "used_context": [...], "prompt_tokens": N}, plus "timings" if asked for (see /query)
     """
     body = request.get_json(force=True)
     q = body.get("query")
     if not q:
         return jsonify({"error": "Missing 'query' field"}), 400
 
-    top_k = int(body.get("top_k", 3))
-    regions = body.get("regions", None)
+    args, error = parse_retrieval_body(body)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Retrieve relevant chunks
-    retrieved = retrieve(q, regions=regions, top_k=top_k)
-    context_chunks = [r["chunk"] for r in retrieved]
+    with collect_timings(bool(body.get("timings"))) as timings:
+        # Retrieve relevant chunks
+        retrieved = retrieve(q, **args)
+        context_chunks, chunk_ids, tokens = pack_context(q, retrieved, build_data_prompt)
 
-    if not context_chunks:
-        return jsonify({"data": [], "used_context": []})
+        if not context_chunks:
+            payload = {"data": [], "used_context": [], "prompt_tokens": 0}
+        else:
+            # Generate structured dataset
+            data = generate_structured_data(q, context_chunks, chunk_ids)
+            payload = {
+                "data": data,
+                "used_context": context_chunks,
+                "prompt_tokens": tokens
+            }
+    if timings is not None:
+        payload["timings"] = timings
+    return jsonify(payload)
 
-    # Generate structured dataset
-    data = generate_structured_data(q, context_chunks)
 
-    return jsonify({
-        "data": data,
-        "used_context": context_chunks
-    })
\ No newline at end of file
+@query_bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """
+    GET /api/cache/stats
+    Response: {"llm": {"hits", "misses", "expired", "evictions", "entries", "hit_rate", ...},
+               "retrieval": {"hits", "misses"},
+               "coalescing": {"single_flight": {"calls", "shared"}, "data_batches": {"items", "batches"}}}
+    """
+    return jsonify({"llm": get_response_cache().snapshot(), "retrieval": dict(result_cache_stats),
+                    "coalescing": coalescing_stats()})
+
+
+@query_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    GET /api/metrics
+    Prometheus text format: per-stage latency histograms (rag_stage_seconds), counters for
+    chunks scanned, LLM calls and tokens, ingested chunks, and cache hit rates.
+    """
+    llm = get_response_cache().snapshot()
+    retrieval_lookups = result_cache_stats["hits"] + result_cache_stats["misses"]
+    coalescing = coalescing_stats()
+    counters = {
+        "rag_retrieval_cache_hits_total": result_cache_stats["hits"],
+        "rag_retrieval_cache_misses_total": result_cache_stats["misses"],
+        "rag_llm_cache_hits_total": llm["hits"],
+        "rag_llm_cache_misses_total": llm["misses"],
+        "rag_llm_calls_shared_total": coalescing["single_flight"]["shared"],
+    }
+    gauges = {
+        "rag_retrieval_cache_hit_ratio": result_cache_stats["hits"] / retrieval_lookups if retrieval_lookups else 0.0,
+        "rag_llm_cache_hit_ratio": llm["hit_rate"],
+        "rag_llm_cache_entries": llm["entries"],
+        "rag_index_chunks": len(get_cache(DB_PATH).vectors),
+    }
+    return Response(metrics.render(counters, gauges), mimetype="text/plain; version=0.0.4")
@@ -1,14 +1,22 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 from sqlalchemy import (
     create_engine,
     Column,
+    Float,
     Integer,
     String,
     Text,
     ForeignKey,
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from srcs.api_endpoints.app.db.connection import get_manager
 
 
 # ============================================================
@@ -34,10 +42,27 @@ RECORDING_ID = None
 #                 INTERNAL CONFIG
 # ============================================================
 
-DB_URL = "sqlite:///hackathon.db"
+DB_PATH = "hackathon.db"
+DB_URL = f"sqlite:///{DB_PATH}"
 SUPPORTED_SUFFIXES = {".txt", ".md", ".docx", ".pdf"}
 
-engine = create_engine(DB_URL, echo=False, future=True)
+# The chunk/index store /api/query reads: RAG_DB_PATH, as for the API, else its
+# default relative to where the API runs (srcs/api_endpoints)
+STORE_PATH = os.getenv("RAG_DB_PATH") or str(Path(__file__).resolve().parents[1] / "api_endpoints" / "rag_demo.sqlite3")
+
+# Extraction processes, files per commit, and how often progress is printed
+WORKERS = os.cpu_count() or 2
+BATCH_SIZE = 50
+REPORT_EVERY_SECONDS = 5.0
+
+# connections come from the same manager as the RAG store: WAL, busy timeout, shared across threads
+engine = create_engine(
+    "sqlite://",
+    creator=lambda: get_manager(DB_PATH).connect(check_same_thread=False),
+    poolclass=QueuePool,
+    echo=False,
+    future=True,
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 Base = declarative_base()
@@ -75,6 +100,16 @@ class TranscriptFile(Base):
     recording = relationship("Recording", back_populates="transcripts")
 
 
+class IngestCheckpoint(Base):
+    """Files already ingested, committed together with their TranscriptFile rows."""
+    __tablename__ = "IngestCheckpoint"
+
+    file_path = Column(String, primary_key=True)
+    file_size = Column(Integer, nullable=False)
+    file_mtime = Column(Float, nullable=False)
+    transcript_id = Column(Integer, ForeignKey("TranscriptFile.transcript_id"))
+
+
 # ============================================================
 #                 DB INITIALIZATION
 # ============================================================
@@ -96,7 +131,7 @@ def extract_text_from_file(path: Path) -> str:
         return path.read_text(encoding="utf-8", errors="ignore")
 
     elif suffix == ".docx":
-        #from docx import Document
+        from docx import Document
         doc = Document(str(path))
         return "\n".join(p.text for p in doc.paragraphs)
 
@@ -129,45 +164,136 @@ def iter_supported_files(root: Path):
             yield f
 
 
+def extract_worker(path_str: str):
+    """Runs in a pool process: (path, size, mtime, text, error)."""
+    path = Path(path_str)
+    try:
+        stat = path.stat()
+        return path_str, stat.st_size, stat.st_mtime, extract_text_from_file(path), None
+    except Exception as e:
+        return path_str, 0, 0.0, None, str(e)
+
+
 # ============================================================
 #                 INGESTION LOGIC
 # ============================================================
 
-def ingest_single_path(session, path: Path, language: str, recording_id: int | None):
-    print(f"[*] Ingesting: {path}")
-
-    text = extract_text_from_file(path)
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def add(self, size: int = 0, failed: bool = False):
+        self.done += 1
+        self.failed += failed
+        self.bytes += size
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._reported < REPORT_EVERY_SECONDS:
+            return
+        self._reported = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"[*] {self.done}/{self.total} files ({self.failed} failed) | "
+              f"{self.done / elapsed:.1f} files/s | {self.bytes / elapsed / 1e6:.2f} MB/s | {elapsed:.0f}s")
+
+
+def pending_files(session, paths):
+    """Supported files under `paths` that changed since their checkpoint, or were never ingested."""
+    done = {cp.file_path: (cp.file_size, cp.file_mtime) for cp in session.query(IngestCheckpoint)}
+    files = []
+    for raw in paths:
+        root = Path(raw)
+        if not root.exists():
+            print(f"[!] Path does not exist: {root}")
+            continue
+
+        for f in iter_supported_files(root):
+            stat = f.stat()
+            if done.get(str(f.resolve())) != (stat.st_size, stat.st_mtime):
+                files.append(f)
+    return files
+
+
+def commit_batch(session, batch, language: str, recording_id: int | None, store_path: str | None):
+    """Save one batch of (path, size, mtime, text) and its checkpoints in one commit."""
+    documents = []
+    for path_str, size, mtime, text in batch:
+        path = Path(path_str)
+        file_path = str(path.resolve())
+        # a changed file replaces its earlier transcript instead of adding another
+        tf = session.query(TranscriptFile).filter_by(file_path=file_path).first()
+        if tf is None:
+            tf = TranscriptFile(file_path=file_path)
+            session.add(tf)
+        tf.recording_id = recording_id
+        tf.file_name = path.name
+        tf.file_type = path.suffix.lower()
+        tf.language = language
+        tf.full_text = text
+        session.flush()
+
+        session.merge(IngestCheckpoint(file_path=file_path, file_size=size, file_mtime=mtime,
+                                       transcript_id=tf.transcript_id))
+        metadata = {"doc_id": file_path, "file_name": path.name, "file_type": tf.file_type, "language": language}
+        if recording_id is not None:
+            metadata["recording_id"] = recording_id
+        documents.append((text, metadata))
+
+    if store_path and documents:
+        # unchanged documents are skipped by content hash, so a rerun after a crash here is cheap
+        from srcs.api_endpoints.app.logic.ingest_logic import ingest_documents
+        ingest_documents(documents, db_path=store_path)
+    session.commit()
+
+
+def ingest_paths(paths, language: str, recording_id: int | None, workers: int = WORKERS,
+                 batch_size: int = BATCH_SIZE, store_path: str | None = STORE_PATH):
+    """Extract files in a process pool and commit them in batches; reruns resume from the checkpoints."""
+    if store_path:
+        from srcs.api_endpoints.app.db.vector_store import VectorStore
+        VectorStore(store_path).initialize()
 
-    tf = TranscriptFile(
-        recording_id=recording_id,
-        file_path=str(path.resolve()),
-        file_name=path.name,
-        file_type=path.suffix.lower(),
-        language=language,
-        full_text=text,
-    )
-
-    session.add(tf)
-    session.flush()
-
-    print(f"      -> Saved as TranscriptFile ID {tf.transcript_id}")
-
-
-def ingest_paths(paths, language: str, recording_id: int | None):
     with SessionLocal() as session:
-        for raw in paths:
-            root = Path(raw)
-            if not root.exists():
-                print(f"[!] Path does not exist: {root}")
-                continue
-
-            for f in iter_supported_files(root):
-                try:
-                    ingest_single_path(session, f, language, recording_id)
-                except Exception as e:
-                    print(f"[!] Failed to ingest {f}: {e}")
-
-        session.commit()
+        files = pending_files(session, paths)
+        print(f"[*] {len(files)} files to ingest")
+        progress = Progress(len(files))
+
+        # at most `max_in_flight` extractions queued or running, and one batch waiting to commit
+        max_in_flight = 2 * workers
+        remaining = iter(files)
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            in_flight = set()
+            while True:
+                for f in remaining:
+                    in_flight.add(pool.submit(extract_worker, str(f)))
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path_str, size, mtime, text, error = future.result()
+                    if error is not None:
+                        print(f"[!] Failed to ingest {path_str}: {error}")
+                        progress.add(failed=True)
+                        continue
+                    batch.append((path_str, size, mtime, text))
+                    progress.add(size)
+
+                if len(batch) >= batch_size:
+                    commit_batch(session, batch, language, recording_id, store_path)
+                    batch = []
+                progress.report()
+
+        commit_batch(session, batch, language, recording_id, store_path)
+        progress.report(force=True)
         print("[*] All changes committed.")
 
 
@@ -175,9 +301,26 @@ def ingest_paths(paths, language: str, recording_id: int | None):
 #                 MAIN EXECUTION
 # ============================================================
 
-def main():
+# Run from the repository root so the RAG store can be imported:
+#   python -m srcs.bara.Databases [paths ...] [--workers N] [--batch-size N] [--no-store]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest transcript files into the hackathon DB and the RAG store.")
+    parser.add_argument("paths", nargs="*", default=INPUT_PATHS, help="files or folders (default: INPUT_PATHS)")
+    parser.add_argument("--language", default=LANGUAGE)
+    parser.add_argument("--recording-id", type=int, default=RECORDING_ID)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="extraction processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="files per commit")
+    parser.add_argument("--store", default=STORE_PATH, help="RAG store the API reads (default: %(default)s)")
+    parser.add_argument("--no-store", action="store_true", help="only fill the SQLAlchemy DB")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     init_db()
-    ingest_paths(INPUT_PATHS, LANGUAGE, RECORDING_ID)
+    ingest_paths(args.paths, args.language, args.recording_id, workers=args.workers,
+                 batch_size=args.batch_size, store_path=None if args.no_store else args.store)
     print("[*] Finished ingestion.")
 
 
@@ -0,0 +1,108 @@
+"""Deterministic synthetic corpora for the benchmarks.
+
+Documents mix Czech, Slovak, English and German text. Words are drawn from
+a Zipf-like distribution over a per-language vocabulary of real stems plus
+generated inflections, so postings lists have realistic skew. Every
+document carries region, language and doc_id metadata.
+"""
+import bisect
+import random
+from itertools import accumulate
+from typing import Iterator, List, Tuple
+
+REGIONS = [
+    "Praha", "Brno", "Ostrava", "Plzeň", "Liberec", "Olomouc", "Karlovy Vary",
+    "Hradec Králové", "Pardubice", "Zlín", "Jihlava", "České Budějovice", "Ústí nad Labem", "Bratislava",
+]
+
+STEMS = {
+    "cs": "škol učitel žák dět matematik čten hodin tříd rodič ředitel projekt výuk znalost"
+          " dovednost hodnocen test úkol kniž jazyk příprav obec kraj vzdělán metod skupin",
+    "sk": "škol učiteľ žiak det matematik čítan hodin tried rodič riaditeľ projekt výučb znalost"
+          " zručnost hodnoten test úloh knih jazyk príprav obec kraj vzdelan metód skupin",
+    "en": "school teacher pupil child math read lesson class parent principal project teach"
+          " knowledge skill assess test task book language prepar town region educat method group",
+    "de": "schul lehrer schüler kind mathemat les stund klass elter direktor projekt unterricht"
+          " wiss fähigkeit bewert test aufgab buch sprach vorbereit gemeind region bild method grupp",
+}
+SUFFIXES = {
+    "cs": ["a", "y", "u", "e", "ě", "ou", "ami", "ách", "ům", "í", "ého", "ová", "ní", "ky"],
+    "sk": ["a", "y", "u", "e", "ou", "ami", "ách", "om", "í", "ého", "ová", "nie", "ky"],
+    "en": ["", "s", "ing", "ed", "er", "ers", "al", "ly", "ment", "ion"],
+    "de": ["", "e", "en", "er", "es", "ung", "ungen", "lich", "isch", "keit"],
+}
+FILLER = {
+    "cs": "a v na se že je to s z do o k jako pro ale jsou",
+    "sk": "a v na sa že je to s z do o k ako pre ale sú",
+    "en": "the a of and to in is that for on with as are it",
+    "de": "der die das und zu in ist dass für auf mit als sind es",
+}
+LANGUAGES = list(STEMS)
+
+# words per document; chunk_text adds about 57 new words per chunk at these sentence lengths
+WORDS_PER_DOCUMENT = 1150
+CHUNKS_PER_DOCUMENT = 20
+
+
+class Language:
+    def __init__(self, code: str, rng: random.Random, rare_words: int = 5000):
+        self.code = code
+        words = [stem + suffix for stem in STEMS[code].split() for suffix in SUFFIXES[code]]
+        # a long tail of rare, generated terms
+        alphabet = "abcdefghijklmnoprstuvyz" + ("áéíóúýčďěňřšťž" if code in ("cs", "sk") else "")
+        words += ["".join(rng.choice(alphabet) for _ in range(rng.randint(5, 10))) for _ in range(rare_words)]
+        self.words = words
+        self.filler = FILLER[code].split()
+        self._cum = list(accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+
+    def word(self, rng: random.Random) -> str:
+        if rng.random() < 0.3:
+            return rng.choice(self.filler)
+        return self.words[bisect.bisect_left(self._cum, rng.random() * self._cum[-1])]
+
+    def sentence(self, rng: random.Random) -> str:
+        words = [self.word(rng) for _ in range(rng.randint(6, 20))]
+        return " ".join(words).capitalize() + rng.choice(".....?!")
+
+
+class SyntheticCorpus:
+    def __init__(self, n_chunks: int, seed: int = 0):
+        self.n_chunks = n_chunks
+        self.n_documents = max(1, -(-n_chunks // CHUNKS_PER_DOCUMENT))
+        self.seed = seed
+        rng = random.Random(seed)
+        self.languages = [Language(code, rng) for code in LANGUAGES]
+
+    def document(self, index: int) -> Tuple[str, dict]:
+        rng = random.Random(self.seed * 1_000_003 + index)
+        language = self.languages[index % len(self.languages)]
+        # the last document is shorter so the corpus lands near n_chunks
+        remaining = self.n_chunks - index * CHUNKS_PER_DOCUMENT
+        n_words = WORDS_PER_DOCUMENT * min(CHUNKS_PER_DOCUMENT, remaining) // CHUNKS_PER_DOCUMENT
+        sentences, words = [], 0
+        while words < n_words:
+            sentence = language.sentence(rng)
+            sentences.append(sentence)
+            words += sentence.count(" ") + 1
+        metadata = {
+            "doc_id": f"bench-{index}",
+            "regions": [rng.choice(REGIONS)],
+            "language": language.code,
+        }
+        return " ".join(sentences), metadata
+
+    def documents(self) -> Iterator[Tuple[str, dict]]:
+        for index in range(self.n_documents):
+            yield self.document(index)
+
+    def queries(self, n: int, filtered_share: float = 0.3, seed: int = 1) -> List[Tuple[str, List[str]]]:
+        """(query, regions) pairs: 2-5 corpus words, a region filter on `filtered_share` of them."""
+        rng = random.Random(seed)
+        queries = []
+        for _ in range(n):
+            language = rng.choice(self.languages)
+            words = [w for w in language.words[:200] if len(w) > 3]
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(2, 5)))
+            regions = [rng.choice(REGIONS)] if rng.random() < filtered_share else None
+            queries.append((text, regions))
+        return queries
@@ -0,0 +1,346 @@
+"""Retrieval and ingest benchmarks over synthetic corpora.
+
+Run from the repository root:
+
+    python -m srcs.benchmarks.run --sizes 1000,10000,100000 --output bench.json
+
+Each corpus size gets its own temporary store. Four phases run in
+separate processes, so each phase's peak RSS is its own:
+
+  ingest  chunks/s and documents/s through ingest_documents()
+  boot    time to import the app and run create_app() (including the
+          retrieval warm-up), and the first /api/query after it
+  query   index load time, p50/p95/p99 retrieve() latency per ranking, and
+          end-to-end /api/query latency against a local stub LLM
+  recall  recall@k of retrieve() against a full scan of every chunk
+
+Results are written as JSON (see `--output`); RETRIEVAL_* and other app
+settings are taken from the environment as usual.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_SIZES = "1000,10000,100000"
+DEFAULT_RANKINGS = "cosine,bm25"
+PHASES = ("ingest", "boot", "query", "recall")
+# libraries the API loads on first use; the boot phase reports any that create_app() pulled in
+LAZY_MODULES = ("openai", "httpx", "pdfplumber", "mammoth", "markdown", "bs4", "openpyxl", "requests", "numpy")
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def at(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {"p50_ms": at(50), "p95_ms": at(95), "p99_ms": at(99),
+            "mean_ms": sum(ordered) / len(ordered) * 1000, "n": len(ordered)}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ---------- phases (run in a child process, app settings already in the environment) ----------
+
+def phase_ingest(args) -> dict:
+    from .corpus import SyntheticCorpus
+    from srcs.api_endpoints.app.db.vector_store import VectorStore
+    from srcs.api_endpoints.app.logic.ingest_logic import ingest_documents
+
+    corpus = SyntheticCorpus(args.size, seed=args.seed)
+    store = VectorStore()
+    store.initialize()
+    start = time.perf_counter()
+    result = ingest_documents(corpus.documents())
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": result["inserted_documents"],
+        "chunks": result["inserted_chunks"],
+        "seconds": elapsed,
+        "chunks_per_second": result["inserted_chunks"] / elapsed if elapsed else None,
+        "documents_per_second": result["inserted_documents"] / elapsed if elapsed else None,
+        "db_bytes": os.path.getsize(store.db_path),
+    }
+
+
+def phase_boot(args) -> dict:
+    from .corpus import SyntheticCorpus
+    from .stub_llm import StubLLMServer
+
+    stub = StubLLMServer(latency_ms=args.llm_latency_ms).start()
+    os.environ["FEATHERLESS_BASE_URL"] = stub.base_url
+    start = time.perf_counter()
+    from srcs.api_endpoints.app import create_app
+    imported = time.perf_counter()
+    client = create_app().test_client()
+    booted = time.perf_counter()
+    from srcs.api_endpoints.app.logic.metrics import metrics
+    warm_up = metrics.stages.get("retrieval.warm_up")
+    loaded = [m for m in LAZY_MODULES if m in sys.modules]
+
+    text, regions = SyntheticCorpus(args.size, seed=args.seed).queries(1, seed=args.seed + 1)[0]
+    response = client.post("/api/query", json={"query": text, "regions": regions, "top_k": args.top_k})
+    first_query = time.perf_counter() - booted
+    stub.stop()
+    return {
+        "import_seconds": imported - start,
+        "boot_seconds": booted - imported,
+        "warm_up_seconds": warm_up[-1] if warm_up else None,
+        "first_query_ms": first_query * 1000 if response.status_code == 200 else None,
+        "modules_loaded_at_boot": loaded,
+    }
+
+
+def phase_query(args) -> dict:
+    from .corpus import SyntheticCorpus
+    from .stub_llm import StubLLMServer
+
+    stub = StubLLMServer(latency_ms=args.llm_latency_ms).start()
+    os.environ["FEATHERLESS_BASE_URL"] = stub.base_url
+    from srcs.api_endpoints.app.logic.retrieval_logic import retrieve
+
+    queries = SyntheticCorpus(args.size, seed=args.seed).queries(args.queries, seed=args.seed + 1)
+    start = time.perf_counter()
+    retrieve(*queries[0], top_k=args.top_k)  # builds the in-memory index
+    results = {"index_load_seconds": time.perf_counter() - start, "retrieve": {}}
+
+    for ranking in args.rankings:
+        if ranking in ("dense", "hybrid"):
+            _embed_all()
+        retrieve(*queries[0], top_k=args.top_k, ranking=ranking)  # warm up ranking-specific state
+        samples = []
+        for text, regions in queries:
+            start = time.perf_counter()
+            retrieve(text, regions, top_k=args.top_k, ranking=ranking)
+            samples.append(time.perf_counter() - start)
+        results["retrieve"][ranking] = percentiles(samples)
+
+    if args.e2e_queries:
+        from srcs.api_endpoints.app import create_app
+        client = create_app().test_client()
+        samples, errors = [], 0
+        for text, regions in queries[:args.e2e_queries]:
+            start = time.perf_counter()
+            response = client.post("/api/query", json={"query": text, "regions": regions, "top_k": args.top_k})
+            samples.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+        results["e2e_query"] = dict(percentiles(samples), errors=errors, llm_calls=stub.calls,
+                                    llm_latency_ms=args.llm_latency_ms)
+    stub.stop()
+    return results
+
+
+def _full_scan(rows, q_vec, regions, top_k: int) -> List[int]:
+    """Exact cosine top-k over every chunk, as the original retrieve() loop computed it."""
+    from srcs.api_endpoints.app.db.vector_store import meta_value
+    from srcs.api_endpoints.app.logic.retrieval_logic import cosine_sim
+
+    wanted = {meta_value(r) for r in regions} if regions else None
+    scored = []
+    for r in rows:
+        if wanted and not wanted & {meta_value(v) for v in r["metadata"].get("regions", [])}:
+            continue
+        score = cosine_sim(q_vec, r["tokens"])
+        if score > 0:
+            scored.append((score, r["id"]))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [cid for _, cid in scored[:top_k]]
+
+
+def _full_scan_bm25(rows, q_vec, regions, top_k: int) -> List[int]:
+    from srcs.api_endpoints.app.db.vector_store import meta_value
+    from srcs.api_endpoints.app.logic.retrieval_logic import BM25_B, BM25_K1, bm25_idf
+
+    avg_len = sum(sum(r["tokens"].tfs) for r in rows) / len(rows) if rows else 0.0
+    weights = {}
+    for term_id, count in q_vec.items():
+        df = sum(1 for r in rows if r["tokens"].get(term_id))
+        weights[term_id] = count * bm25_idf(df, len(rows))
+    wanted = {meta_value(r) for r in regions} if regions else None
+    scored = []
+    for r in rows:
+        if wanted and not wanted & {meta_value(v) for v in r["metadata"].get("regions", [])}:
+            continue
+        length = sum(r["tokens"].tfs)
+        score = 0.0
+        for term_id, weight in weights.items():
+            tf = r["tokens"].get(term_id)
+            if tf:
+                score += weight * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len))
+        if score > 0:
+            scored.append((score, r["id"]))
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    return [cid for _, cid in scored[:top_k]]
+
+
+def phase_recall(args) -> dict:
+    from .corpus import SyntheticCorpus
+    from srcs.api_endpoints.app.db.vector_store import VectorStore
+    from srcs.api_endpoints.app.logic.retrieval_logic import retrieve, token_counts
+
+    store = VectorStore()
+    rows = store.all_chunks()
+    queries = SyntheticCorpus(args.size, seed=args.seed).queries(args.recall_queries, seed=args.seed + 1)
+    results = {}
+    if "dense" in args.rankings:
+        _embed_all()
+    for ranking in args.rankings:
+        if ranking not in ("cosine", "bm25", "dense"):
+            results[ranking] = None  # a fusion of rankings has no exact counterpart
+            continue
+        recalls = []
+        for text, regions in queries:
+            got = [r["id"] for r in retrieve(text, regions, top_k=args.top_k, ranking=ranking)]
+            if ranking == "dense":
+                expected = _exact_dense(store, text, regions, args.top_k)
+            elif ranking == "bm25":
+                # BM25 statistics are corpus-wide even when filtering
+                expected = _full_scan_bm25(rows, store.encode(token_counts(text)), regions, args.top_k)
+            else:
+                expected = _full_scan(rows, store.encode(token_counts(text)), regions, args.top_k)
+            if expected:
+                recalls.append(len(set(got) & set(expected)) / len(expected))
+        results[ranking] = {"recall_at_k": sum(recalls) / len(recalls) if recalls else None,
+                            "k": args.top_k, "n": len(recalls)}
+    return results
+
+
+def _embed_all() -> int:
+    """Embed the corpus now, as the dense index otherwise does in the background after the first query."""
+    from srcs.api_endpoints.app.db.dense_index import get_dense_index
+    from srcs.api_endpoints.app.db.vector_store import DB_PATH
+    from srcs.api_endpoints.app.logic.embedding_logic import get_embedder
+
+    return get_dense_index(DB_PATH, get_embedder()).backfill()
+
+
+def _exact_dense(store, text: str, regions, top_k: int) -> List[int]:
+    """Search every IVF cluster, which is an exhaustive scan."""
+    from srcs.api_endpoints.app.db.dense_index import get_dense_index
+    from srcs.api_endpoints.app.logic.embedding_logic import get_embedder
+
+    cache = store.cache()
+    embedder = get_embedder()
+    index = get_dense_index(store.db_path, embedder).sync(cache.generation)
+    with cache.lock:
+        allowed = cache.matching({"regions": regions}) if regions else None
+    q_vec = embedder.embed([text])[0]
+    return [cid for _, cid in index.search(q_vec, top_k, allowed, nprobe=len(index.centroids))]
+
+
+PHASE_FUNCTIONS = {"ingest": phase_ingest, "boot": phase_boot, "query": phase_query, "recall": phase_recall}
+
+
+def run_phase(args):
+    result = PHASE_FUNCTIONS[args.phase](args)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+# ---------- driver ----------
+
+def _child_args(args, phase: str, size: int) -> List[str]:
+    return [
+        sys.executable, "-m", "srcs.benchmarks.run", "--phase", phase, "--sizes", str(size),
+        "--seed", str(args.seed), "--queries", str(args.queries), "--recall-queries", str(args.recall_queries),
+        "--e2e-queries", str(args.e2e_queries), "--top-k", str(args.top_k),
+        "--rankings", ",".join(args.rankings), "--llm-latency-ms", str(args.llm_latency_ms),
+    ]
+
+
+def benchmark_size(args, size: int) -> dict:
+    result = {"target_chunks": size}
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as workdir:
+        env = dict(os.environ)
+        env.update({
+            "RAG_DB_PATH": os.path.join(workdir, "bench.sqlite3"),
+            "INGEST_UPLOAD_DIR": os.path.join(workdir, "uploads"),
+            # every query must reach the index, not the result LRU
+            "RETRIEVAL_CACHE_SIZE": "0",
+            "FEATHERLESS_API_KEY": env.get("FEATHERLESS_API_KEY") or "stub",
+        })
+        for phase in PHASES:
+            if phase == "recall" and not args.recall_queries:
+                continue
+            start = time.perf_counter()
+            proc = subprocess.run(_child_args(args, phase, size), cwd=REPO_ROOT, env=env,
+                                  capture_output=True, text=True)
+            if proc.returncode != 0:
+                result[phase] = {"error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+                sys.stderr.write(proc.stderr)
+                break
+            result[phase] = json.loads(proc.stdout.strip().splitlines()[-1])
+            result[phase]["wall_seconds"] = time.perf_counter() - start
+            print(f"{size:>9} chunks  {phase:<6} done in {result[phase]['wall_seconds']:.1f}s", file=sys.stderr)
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+        "settings": {k: v for k, v in os.environ.items()
+                     if k.startswith(("RETRIEVAL_", "RAG_", "CONTEXT_", "EMBEDDING_", "SQLITE_"))},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingest and retrieval on synthetic corpora.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"corpus sizes in chunks (default {DEFAULT_SIZES})")
+    parser.add_argument("--rankings", default=DEFAULT_RANKINGS, help=f"(default {DEFAULT_RANKINGS})")
+    parser.add_argument("--queries", type=int, default=200, help="timed retrieve() calls per ranking")
+    parser.add_argument("--recall-queries", type=int, default=20, help="queries checked against a full scan")
+    parser.add_argument("--e2e-queries", type=int, default=50, help="timed /api/query requests")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="delay added by the stub LLM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--phase", choices=PHASES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.rankings = [r for r in args.rankings.split(",") if r]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.phase:
+        args.size = args.sizes[0]
+        run_phase(args)
+        return
+
+    report = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "environment": environment(),
+              "parameters": {"rankings": args.rankings, "queries": args.queries, "top_k": args.top_k,
+                             "recall_queries": args.recall_queries, "e2e_queries": args.e2e_queries,
+                             "llm_latency_ms": args.llm_latency_ms, "seed": args.seed},
+              "runs": [benchmark_size(args, size) for size in args.sizes]}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
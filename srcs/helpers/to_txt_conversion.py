@@ -1,43 +1,163 @@
-import pdfplumber
-import mammoth
-import markdown
-import requests
-from bs4 import BeautifulSoup
-import openpyxl
-from .audio_transcription import transcribe_audio
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "md", "mp3", "xlsx")
+# PDFs with at least this many pages are extracted in parallel, PDF_PAGES_PER_TASK pages per task
+PDF_PARALLEL_MIN_PAGES = 32
+PDF_PAGES_PER_TASK = 16
+# spreadsheet rows per yielded piece
+XLSX_ROWS_PER_PIECE = 1000
 
+# Converter libraries (pdfplumber, mammoth, markdown, bs4, openpyxl, requests) are
+# imported on first use: together they take about half a second to load, which
+# every API worker would otherwise pay at boot.
 
-def convert_to_text(input_path):
+
+def _no_progress(fraction):
+    pass
+
+
+def _pdf_pages(input_path, start, stop):
+    """Text of pages [start, stop); runs in a worker process for large PDFs."""
+    import pdfplumber
+    texts = []
+    with pdfplumber.open(input_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            texts.append((page.extract_text() or "") + "\n")
+            page.close()  # drop pdfplumber's per-page object cache
+    return texts
+
+
+def _iter_pdf(input_path, executor=None, progress=_no_progress, max_in_flight=None):
+    import pdfplumber
+    with pdfplumber.open(input_path) as pdf:
+        n_pages = len(pdf.pages)
+        if n_pages < PDF_PARALLEL_MIN_PAGES:
+            for i, page in enumerate(pdf.pages):
+                yield (page.extract_text() or "") + "\n"
+                page.close()
+                progress((i + 1) / n_pages)
+            return
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
+    try:
+        # keep a bounded number of page ranges in flight so memory stays flat
+        if max_in_flight is None:
+            # ProcessPoolExecutor() runs one worker per CPU
+            max_in_flight = 2 * (os.cpu_count() or 1)
+        ranges = iter(range(0, n_pages, PDF_PAGES_PER_TASK))
+        pending = deque()
+        for start in ranges:
+            pending.append(executor.submit(_pdf_pages, input_path, start, start + PDF_PAGES_PER_TASK))
+            if len(pending) >= max_in_flight:
+                break
+        done = 0
+        while pending:
+            texts = pending.popleft().result()
+            start = next(ranges, None)
+            if start is not None:
+                pending.append(executor.submit(_pdf_pages, input_path, start, start + PDF_PAGES_PER_TASK))
+            for text in texts:
+                yield text
+                done += 1
+                progress(done / n_pages)
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def _docx_text(input_path):
+    import mammoth
+    with open(input_path, "rb") as f:
+        return mammoth.extract_raw_text(f).value
+
+
+def _iter_lines(lines, per_piece):
+    """Yield pieces that concatenate to "\\n".join(lines), `per_piece` lines at a time."""
+    block = []
+    first = True
+    for line in lines:
+        block.append(line)
+        if len(block) >= per_piece:
+            yield ("" if first else "\n") + "\n".join(block)
+            first = False
+            block = []
+    if block:
+        yield ("" if first else "\n") + "\n".join(block)
+
+
+def _xlsx_lines(input_path, progress=_no_progress):
+    import openpyxl
+    # read-only mode streams rows instead of loading the whole workbook
+    wb = openpyxl.load_workbook(input_path, data_only=True, read_only=True)
+    try:
+        n_sheets = len(wb.sheetnames)
+        for i, sheet in enumerate(wb.sheetnames):
+            ws = wb[sheet]
+            yield f"\n=== Sheet: {sheet} ===\n"
+            # max_row comes from the sheet's declared dimensions and may be missing
+            n_rows = ws.max_row or 0
+            for j, row in enumerate(ws.iter_rows(values_only=True), 1):
+                yield "\t".join("" if v is None else str(v) for v in row)
+                if j % XLSX_ROWS_PER_PIECE == 0 and n_rows:
+                    progress((i + min(j / n_rows, 1.0)) / n_sheets)
+            progress((i + 1) / n_sheets)
+    finally:
+        wb.close()
+
+
+def iter_text(input_path, executor=None, progress=None, max_in_flight=None):
     """
-    Converts PDF, DOCX, MD, or MP3 into a single string.
-    Returns the extracted plain text.
+    Converts PDF, DOCX, MD, MP3 or XLSX into text, yielded piece by piece
+    (per page, paragraph or block of spreadsheet rows).
+    The pieces concatenate to the same string convert_to_text returns.
+    `executor` (a ProcessPoolExecutor) is used for CPU-heavy parsing; large
+    PDFs get a temporary one if none is given. `max_in_flight` bounds the
+    page ranges submitted to it at once (default: twice the CPU count); pass
+    about twice the executor's worker count.
+    `progress(fraction)` is called with the share of the input converted so
+    far (pages, paragraphs or spreadsheet rows). Callers time and count the
+    pieces themselves; this module stays free of the app package.
     """
     ext = input_path.lower().split(".")[-1]
-    text = ""
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError("Unsupported file type. Use PDF, DOCX, MD, or MP3.")
+    yield from _iter_text(input_path, ext, executor, progress or _no_progress, max_in_flight)
+
 
+def _iter_text(input_path, ext, executor, progress, max_in_flight):
     # PDF → Text
     if ext == "pdf":
-        with pdfplumber.open(input_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-                text += "\n"
+        yield from _iter_pdf(input_path, executor, progress, max_in_flight)
 
     # DOCX → Text (Mammoth)
     elif ext == "docx":
-        with open(input_path, "rb") as f:
-            result = mammoth.extract_raw_text(f)
-            text = result.value
+        if executor is not None:
+            text = executor.submit(_docx_text, input_path).result()
+        else:
+            text = _docx_text(input_path)
+        paragraphs = text.split("\n\n")
+        for i, paragraph in enumerate(paragraphs):
+            yield paragraph if i == len(paragraphs) - 1 else paragraph + "\n\n"
+            progress((i + 1) / len(paragraphs))
 
     # MD → Text
     elif ext == "md":
+        import markdown
+        from bs4 import BeautifulSoup
         with open(input_path, "r", encoding="utf-8") as f:
             md = f.read()
         html = markdown.markdown(md)
-        text = BeautifulSoup(html, "html.parser").get_text()
+        yield BeautifulSoup(html, "html.parser").get_text()
+        progress(1.0)
 
     # MP3 → Transcribed Text
     elif ext == "mp3":
+        import requests
+        from .audio_transcription import transcribe_audio
         # Upload local MP3 to AssemblyAI first
         base_url = "https://api.assemblyai.com/v2/upload"
         headers = {"authorization": "6e39c034c7f3444a862e60a3245da366"}
@@ -45,22 +165,21 @@ def convert_to_text(input_path):
             upload_response = requests.post(base_url, headers=headers, data=f)
             upload_response.raise_for_status()
             audio_url = upload_response.json()["upload_url"]
+        # the upload is done; transcription is the rest
+        progress(0.3)
 
         # Call your transcription function with the uploaded URL
         text = transcribe_audio(audio_url)
         print(text)
+        yield text
+        progress(1.0)
     elif ext == "xlsx":
-        wb = openpyxl.load_workbook(input_path, data_only=True)
-        out = []
-        for sheet in wb.sheetnames:
-            ws = wb[sheet]
-            out.append(f"\n=== Sheet: {sheet} ===\n")
-            for row in ws.iter_rows(values_only=True):
-                row_text = "\t".join("" if v is None else str(v) for v in row)
-                out.append(row_text)
-        text = "\n".join(out)
+        yield from _iter_lines(_xlsx_lines(input_path, progress), XLSX_ROWS_PER_PIECE)
 
-    else:
-        raise ValueError("Unsupported file type. Use PDF, DOCX, MD, or MP3.")
 
-    return text
+def convert_to_text(input_path):
+    """
+    Converts PDF, DOCX, MD, or MP3 into a single string.
+    Returns the extracted plain text.
+    """
+    return "".join(iter_text(input_path))
@@ -0,0 +1,25 @@
+from srcs.api_endpoints.app.logic.context_logic import assemble_context
+
+
+def _chunk(text, **metadata):
+    return {"chunk": text, "metadata": metadata}
+
+
+def test_chunks_without_doc_id_are_never_merged_or_dropped():
+    retrieved = [
+        _chunk("Alpha school has a new gym.", regions=["prague"], chunk_index=2),
+        _chunk("Beta school opens in autumn.", regions=["prague"], chunk_index=2),
+        _chunk("Gamma report on pupils.", regions=["prague"], chunk_index=3),
+    ]
+    context, _ = assemble_context(retrieved)
+    assert context == [r["chunk"] for r in retrieved]
+
+
+def test_adjacent_chunks_of_one_document_merge_over_their_overlap():
+    retrieved = [
+        _chunk("one two three four", doc_id="d", chunk_index=0),
+        _chunk("three four five six", doc_id="d", chunk_index=1),
+        _chunk("three four five six", doc_id="d", chunk_index=1),
+    ]
+    context, _ = assemble_context(retrieved)
+    assert context == ["one two three four five six"]